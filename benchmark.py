@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарки парсера и запросов бота.
+
+    python benchmark.py record                 # сохранить страницы источников в bench_corpus/
+    python benchmark.py run --output a.json    # прогнать замеры, отчёт в JSON
+    python benchmark.py compare a.json b.json  # сравнить два отчёта (например, до и после коммита)
+
+Сеть не нужна: страницы отдаёт локальный HTTP-сервер из записанного корпуса,
+базы для запросов генерируются с фиксированным seed
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import parser
+from formatters import render_event_fragment
+from http_cache import HttpCache
+
+CORPUS_DIR = "bench_corpus"
+MANIFEST = "manifest.json"
+SEED = 20251017
+
+DEFAULT_ROWS = "10000"
+DEFAULT_FETCH_PAGES = 200
+DEFAULT_REPEAT = 20
+DEFAULT_QUERY_RUNS = 200
+DEFAULT_EVENTS = 10000
+
+# --- Корпус страниц ---
+def record_corpus(sources_path="sources.json", corpus_dir=CORPUS_DIR):
+    """Скачивает ленты и страницы документов из sources.json в корпус"""
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest = []
+    for src in parser.load_sources(sources_path):
+        pages = [("news", src["news_url"])] if src.get("news_url") else []
+        pages += [("docs", url) for url in src.get("doc_urls", [])]
+        for kind, url in pages:
+            # Мимо HTTP-кэша: запись корпуса не должна помечать страницы разобранными для обхода
+            html = parser.fetch(url)
+            if not html:
+                continue
+            name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12] + ".html"
+            with open(os.path.join(corpus_dir, name), "w", encoding="utf-8") as f:
+                f.write(html)
+            manifest.append({"url": url, "kind": kind, "file": name})
+            print(f"[*] Сохранено: {url} -> {name}")
+    with open(os.path.join(corpus_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    print(f"[*] Страниц в корпусе: {len(manifest)}")
+
+def synthetic_news_page(rng, n_items=30):
+    items = []
+    for i in range(n_items):
+        kind = rng.choice(parser.KEYWORDS + ["новость", "объявление", "приказ"])
+        items.append(
+            f'<div class="news-item"><h3><a href="/news/{rng.randrange(10**6)}">'
+            f'{kind.capitalize()} «Тема {i}» для студентов</a></h3>'
+            f'<span class="date">{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2025</span>'
+            f'<p class="anons">Приглашаем принять участие: {kind}, регистрация открыта.</p></div>'
+        )
+    return (
+        '<html><head><meta charset="utf-8"></head><body><div class="news-list">'
+        + "".join(items)
+        + '</div><div class="pagination"><a href="?page=2">Следующая</a></div></body></html>'
+    )
+
+def synthetic_docs_page(rng, n_links=80):
+    links = "".join(
+        f'<li><a href="/doc/{i}">{rng.choice(parser.KEYWORDS + ["положение", "приказ"])} — документ {i}</a></li>'
+        for i in range(n_links)
+    )
+    return f'<html><body><main><ul>{links}</ul></main></body></html>'
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    """[(url, kind, html)] и метка корпуса; без записанного корпуса — синтетические страницы"""
+    manifest_path = os.path.join(corpus_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        pages = []
+        digest = hashlib.sha1()
+        for entry in manifest:
+            with open(os.path.join(corpus_dir, entry["file"]), encoding="utf-8") as f:
+                html = f.read()
+            digest.update(html.encode("utf-8"))
+            pages.append((entry["url"], entry["kind"], html))
+        if pages:
+            return pages, "recorded:" + digest.hexdigest()[:12]
+
+    print(f"[*] Корпус {corpus_dir}/ не записан (python benchmark.py record), используются синтетические страницы")
+    rng = random.Random(SEED)
+    pages = [(f"https://example.org/news/?page={i}", "news", synthetic_news_page(rng)) for i in range(4)]
+    pages += [(f"https://example.org/doc/{i}", "docs", synthetic_docs_page(rng)) for i in range(2)]
+    return pages, "synthetic"
+
+# --- Локальный HTTP-сервер ---
+class StandInServer:
+    """
+    Отдаёт страницы корпуса по адресам /0, /1, ... с задержкой latency (сек)
+    и долей ответов error_status, заданной error_rate
+    """
+
+    def __init__(self, pages, latency=0.0, error_rate=0.0, error_status=503):
+        bodies = [html.encode("utf-8") for _, _, html in pages]
+        rng = random.Random(SEED)
+        lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if latency:
+                    time.sleep(latency)
+                with lock:
+                    failed = rng.random() < error_rate
+                index = self.path.strip("/").split("?")[0]
+                if failed or not index.isdigit() or int(index) >= len(bodies):
+                    self.send_response(error_status if failed else 404)
+                    self.end_headers()
+                    return
+                body = bodies[int(index)]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.page_count = len(bodies)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, index):
+        return f"http://127.0.0.1:{self.server.server_port}/{index}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+# --- Замеры ---
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+def bench_fetch(pages, workdir, n_pages, latency, error_rate):
+    """pages/s для parser.fetch_page через локальный сервер, параллельно как в обходе"""
+    # Бенчмарк не трогает рабочий HTTP-кэш парсера
+    parser.http_cache = HttpCache(os.path.join(workdir, "http_cache.db"))
+    with StandInServer(pages, latency, error_rate) as server:
+        urls = [server.url(i % server.page_count) for i in range(n_pages)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=parser.MAX_CONCURRENCY) as executor:
+            results = list(executor.map(lambda url: parser.fetch_page(url, force=True)[0], urls))
+        elapsed = time.perf_counter() - started
+    return {
+        "pages": n_pages,
+        "failed": sum(1 for html in results if html is None),
+        "latency_s": latency,
+        "error_rate": error_rate,
+        "pages_per_s": round(n_pages / elapsed, 2),
+    }
+
+def bench_parse(pages, repeat):
+    """ms/page для parse_news_list и parse_docs (медиана по повторам)"""
+    backend = parser.PARSER_BACKEND
+    result = {"backend": parser.available_backends()[0] if backend == "auto" else backend}
+    for kind, func in (("news", parser.parse_news_list), ("docs", parser.parse_docs)):
+        subset = [(url, html) for url, k, html in pages if k == kind]
+        if not subset:
+            continue
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for url, html in subset:
+                func(html, url)
+            timings.append((time.perf_counter() - started) * 1000 / len(subset))
+        result[func.__name__] = {"pages": len(subset), "ms_per_page": round(percentile(timings, 50), 3)}
+    return result
+
+def synthetic_events(n, rng):
+    words = ["студентов", "университета", "регистрация", "научный", "молодёжный", "открыта",
+             "приглашаем", "региональный", "победитель", "итоги", "Оренбург", "факультет"]
+    events = []
+    for i in range(n):
+        kind = rng.choice(parser.KEYWORDS + ["новость", "приказ"])
+        events.append({
+            "title": f"{kind.capitalize()} {' '.join(rng.sample(words, 4))} №{i}",
+            "date": f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(2023, 2025)}",
+            "link": f"https://example.org/news/{i}",
+            "description": " ".join(rng.choice(words) for _ in range(rng.randint(5, 25))),
+        })
+    return events
+
+def bench_classify(n_events):
+    """events/s для enrich_and_filter"""
+    events = synthetic_events(n_events, random.Random(SEED))
+    started = time.perf_counter()
+    relevant = parser.enrich_and_filter(events)
+    elapsed = time.perf_counter() - started
+    return {"events": n_events, "relevant": len(relevant), "events_per_s": round(n_events / elapsed, 1)}
+
+def bench_save(workdir, n_events):
+    """
+    events/s для save_events_to_db: первая запись (вставка) и повтор тех же событий,
+    и для прохода склейки почти дубликатов (cluster_events) по вставленным событиям
+    """
+    parser.DB_NAME = os.path.join(workdir, "save_bench.db")
+    events = parser.enrich_and_filter(synthetic_events(n_events, random.Random(SEED)))
+    result = {"events": len(events)}
+    for label in ("insert", "unchanged"):
+        started = time.perf_counter()
+        parser.save_events_to_db(events)
+        result[f"{label}_events_per_s"] = round(len(events) / (time.perf_counter() - started), 1)
+    # Повтор не трогает canonical_id: склеиваются все вставленные события
+    started = time.perf_counter()
+    parser.cluster_events()
+    result["cluster_events_per_s"] = round(len(events) / (time.perf_counter() - started), 1)
+    return result
+
+def build_query_db(path, rows):
+    """Синтетическая база на rows событий со схемой и индексами парсера"""
+    rng = random.Random(SEED)
+    conn = sqlite3.connect(path)
+    parser.init_db(conn)
+    batch = []
+    with conn:
+        for e in synthetic_events(rows, rng):
+            e["detected_type"] = parser.classifier.classify_event(e).detected_type
+            batch.append((e["title"], e["date"], e["link"], e["description"], e["detected_type"],
+                          parser.normalize_date(e["date"]) or "", render_event_fragment(e)))
+            if len(batch) == 10000:
+                conn.executemany(f"""
+                    INSERT INTO {parser.TABLE_NAME} (title, date, link, description, detected_type, date_iso, fragment)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, batch)
+                batch = []
+        if batch:
+            conn.executemany(f"""
+                INSERT INTO {parser.TABLE_NAME} (title, date, link, description, detected_type, date_iso, fragment)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+        # Синтетические события уникальны: каждое само себе каноническое
+        conn.execute(f"UPDATE {parser.TABLE_NAME} SET canonical_id = id")
+    conn.close()
+
+def bench_queries(workdir, sizes, runs):
+    """p50/p99 (мс) функций database.py без кэша результатов, на базах разного размера"""
+    # database.py собирает SQL из TABLE_NAME при импорте
+    os.environ.setdefault("TABLE_NAME", parser.TABLE_NAME)
+    import database
+
+    result = {}
+    for rows in sizes:
+        path = os.path.join(workdir, f"query_{rows}.db")
+        print(f"[*] Генерация базы на {rows} событий")
+        build_query_db(path, rows)
+        database.close_connection()
+        database.DB_NAME = path
+
+        first_page = database.get_events_page.__wrapped__()
+        calls = {
+            "get_events_page": lambda: database.get_events_page.__wrapped__(),
+            "get_events_page_next": lambda: database.get_events_page.__wrapped__(None, first_page.next_cursor),
+            "get_events_page_by_type": lambda: database.get_events_page.__wrapped__("конкурс"),
+            "get_event_types": lambda: database.get_event_types.__wrapped__(),
+            "search_events_page": lambda: database.search_events_page.__wrapped__("конкурсы студентов"),
+            "get_stats": lambda: database.get_stats.__wrapped__(),
+        }
+        result[str(rows)] = {}
+        for name, call in calls.items():
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - started) * 1000)
+            result[str(rows)][name] = {
+                "p50_ms": round(percentile(timings, 50), 3),
+                "p99_ms": round(percentile(timings, 99), 3),
+            }
+        database.close_connection()
+    return result
+
+# --- Отчёт ---
+def run_meta(corpus_label):
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus_label,
+        "seed": SEED,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def flatten(data, prefix=""):
+    out = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            out.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            out[name] = value
+    return out
+
+def compare_reports(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"[*] {old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    if old["meta"].get("corpus") != new["meta"].get("corpus"):
+        print("[*] Внимание: отчёты сняты на разных корпусах")
+    old_flat, new_flat = flatten(old["results"]), flatten(new["results"])
+    for name in sorted(old_flat.keys() & new_flat.keys()):
+        a, b = old_flat[name], new_flat[name]
+        change = f"{(b - a) / a * 100:+.1f}%" if a else "—"
+        print(f"{name:<60} {a:>12} {b:>12} {change:>9}")
+
+def run(args):
+    pages, corpus_label = load_corpus(args.corpus)
+    stages = set(args.only.split(",")) if args.only else {"fetch", "parse", "classify", "save", "queries"}
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        if "fetch" in stages:
+            print("[*] fetch")
+            results["fetch"] = bench_fetch(pages, workdir, args.fetch_pages, args.latency, args.error_rate)
+        if "parse" in stages:
+            print("[*] parse")
+            results["parse"] = bench_parse(pages, args.repeat)
+        if "classify" in stages:
+            print("[*] enrich_and_filter")
+            results["classify"] = bench_classify(args.events)
+        if "save" in stages:
+            print("[*] save_events_to_db")
+            results["save"] = bench_save(workdir, args.events)
+        if "queries" in stages:
+            sizes = [int(n) for n in args.rows.split(",")]
+            results["queries"] = bench_queries(workdir, sizes, args.query_runs)
+
+    report = {"meta": run_meta(corpus_label), "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"[*] Отчёт сохранён: {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Офлайн-бенчмарки парсера и бота")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    record_cmd = commands.add_parser("record", help="записать страницы источников в корпус")
+    record_cmd.add_argument("--corpus", default=CORPUS_DIR)
+
+    run_cmd = commands.add_parser("run", help="прогнать замеры")
+    run_cmd.add_argument("--corpus", default=CORPUS_DIR)
+    run_cmd.add_argument("--only", help="через запятую: fetch, parse, classify, save, queries")
+    run_cmd.add_argument("--backend", default=parser.PARSER_BACKEND, help="HTML-бэкенд: html.parser (по умолчанию), lxml, auto")
+    run_cmd.add_argument("--fetch-pages", type=int, default=DEFAULT_FETCH_PAGES, help="сколько запросов к локальному серверу")
+    run_cmd.add_argument("--latency", type=float, default=0.0, help="задержка ответа сервера, сек")
+    run_cmd.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503 (парсер их ретраит)")
+    run_cmd.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="повторов разбора корпуса")
+    run_cmd.add_argument("--events", type=int, default=DEFAULT_EVENTS, help="событий для классификации и записи")
+    run_cmd.add_argument("--rows", default=DEFAULT_ROWS, help="размеры баз для запросов, например 10000,100000,1000000")
+    run_cmd.add_argument("--query-runs", type=int, default=DEFAULT_QUERY_RUNS, help="вызовов каждой функции database.py")
+    run_cmd.add_argument("--output", help="куда сохранить JSON-отчёт")
+
+    compare_cmd = commands.add_parser("compare", help="сравнить два отчёта")
+    compare_cmd.add_argument("old")
+    compare_cmd.add_argument("new")
+
+    args = arg_parser.parse_args()
+    if args.command == "record":
+        record_corpus(corpus_dir=args.corpus)
+    elif args.command == "compare":
+        compare_reports(args.old, args.new)
+    else:
+        parser.set_backend(args.backend)
+        run(args)
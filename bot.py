@@ -1,17 +1,26 @@
+import asyncio
 import logging
 import os
 from dotenv import load_dotenv
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, InlineQueryHandler
 from bot_handlers import (
     start, help_command, show_events, show_types, 
-    update_data, show_stats, search_command, button_handler
+    update_data, show_stats, search_command, button_handler,
+    subscribe_command, unsubscribe_command, subscriptions_command, inline_query
 )
+from scheduler import schedule_sources
+from parser_utils import refresh_manager
+from notifications import Notifier
+from inline_index import InlineIndex
+from database import get_index_rows
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 DB_NAME = os.getenv('DB_NAME')
 TABLE_NAME = os.getenv('TABLE_NAME')
+# Адрес Bot API вида http://127.0.0.1:8081/bot — например, локальный сервер или заглушка для проверки рассылки
+BOT_API_URL = os.getenv('BOT_API_URL')
 
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле")
@@ -22,9 +31,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def post_init(app):
+    # Процесс парсера поднимается заранее, чтобы первый /update не ждал импортов
+    await refresh_manager.worker.start()
+    # Старая база (до date_iso/canonical_id/FTS) сначала мигрируется, иначе запросы бота к ней падают
+    if not await refresh_manager.upgrade_db():
+        logger.error("Не удалось обновить схему базы")
+    notifier = Notifier(app.bot)
+    notifier.start()
+    app.bot_data["notifier"] = notifier
+    refresh_manager.finished_callbacks.append(notifier.on_refresh)
+    # Индекс для inline-поиска строится один раз из базы, дальше дополняется после каждого обновления
+    inline_index = InlineIndex.build(await asyncio.to_thread(get_index_rows))
+    app.bot_data["inline_index"] = inline_index
+    refresh_manager.finished_callbacks.append(inline_index.on_refresh)
+    logger.info("Inline-индекс построен: событий %d, слов %d", len(inline_index.keys), len(inline_index.words))
+
+async def post_shutdown(app):
+    await refresh_manager.worker.stop()
+    notifier = app.bot_data.get("notifier")
+    if notifier:
+        await notifier.stop()
+
 #---MAIN---
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    # concurrent_updates: пока один пользователь ждёт обновления данных, остальные получают ответы
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    app = builder.build()
     
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
@@ -33,8 +74,14 @@ def main():
     app.add_handler(CommandHandler("update", update_data))
     app.add_handler(CommandHandler("stats", show_stats))
     app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CommandHandler("subscribe", subscribe_command))
+    app.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    app.add_handler(CommandHandler("subscriptions", subscriptions_command))
     
     app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(InlineQueryHandler(inline_query))
+    
+    schedule_sources(app)
     
     print("Бот запущен...")
     app.run_polling()
@@ -1,10 +1,114 @@
-from telegram import Update
+from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 import asyncio
-from database import get_events_by_type, get_event_types, search_events, get_stats
+import hashlib
+import html
+import os
+import time
+from collections import OrderedDict
+from database import (
+    get_events_page, get_event_types, search_events_page, get_stats, cached, trim_page, list_key, search_key,
+    get_events_by_ids
+)
 from parser_utils import run_parser
-from keyboards import get_main_keyboard, get_back_keyboard, get_events_type_keyboard
-from formatters import format_events_list, format_stats, format_event_types
+from keyboards import (
+    get_main_keyboard, get_back_keyboard, get_events_type_keyboard,
+    get_events_page_keyboard, get_search_page_keyboard, parse_page_callback
+)
+from formatters import (
+    format_events_list, format_stats, format_event_types, format_progress, format_slow_sources, format_subscriptions,
+    fit_count, format_query, event_block
+)
+from subscriptions import KIND_TYPE, KIND_KEYWORD
+from metrics import load_report, slowest_sources
+
+# Telegram id администраторов через запятую: им /stats показывает метрики обхода
+ADMIN_IDS = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip()}
+
+# Telegram показывает не больше 50 inline-результатов; столько же секунд клиенты кэшируют ответ
+INLINE_RESULTS = 50
+INLINE_CACHE_TIME = 60
+
+# Сколько последних поисковых запросов помнят кнопки листания
+SEARCH_TOKENS_SIZE = 1024
+
+# Не чаще одного редактирования статуса за столько секунд (лимиты Telegram на edit)
+PROGRESS_EDIT_INTERVAL = 2.0
+
+def progress_updater(message):
+    """Колбэк для run_parser: переписывает статусное сообщение текущим прогрессом"""
+    last = {"text": None, "at": 0.0}
+
+    async def on_progress(progress):
+        text = format_progress(progress)
+        now = time.monotonic()
+        if text == last["text"] or now - last["at"] < PROGRESS_EDIT_INTERVAL:
+            return
+        last["text"], last["at"] = text, now
+        try:
+            await message.edit_text(text)
+        except TelegramError:
+            pass
+
+    return on_progress
+
+# --- Готовые тексты сообщений (кэшируются до следующего поколения данных) ---
+def render_page(page, direction, key):
+    """Страница, урезанная до событий, которые помещаются в одно сообщение, и её текст из готовых блоков"""
+    page = trim_page(page, fit_count(page.events, from_end=direction == "prev"), direction, key)
+    return page, format_events_list(page.events)
+
+@cached("render_events")
+def render_events(event_type, cursor=None, direction="next"):
+    return render_page(get_events_page(event_type, cursor, direction), direction, list_key)
+
+@cached("render_search")
+def render_search(search_query, cursor=None, direction="next"):
+    return render_page(search_events_page(search_query, cursor, direction), direction, search_key)
+
+def remember_search(context, search_query):
+    """Запрос целиком не влезает в callback_data, в кнопки пишется короткий токен"""
+    token = hashlib.sha1(search_query.encode("utf-8")).hexdigest()[:10]
+    queries = context.bot_data.setdefault("search_queries", OrderedDict())
+    queries[token] = search_query
+    queries.move_to_end(token)
+    if len(queries) > SEARCH_TOKENS_SIZE:
+        # Кнопки самых давних поисков ответят «Поиск устарел»
+        queries.popitem(last=False)
+    return token
+
+def recall_search(context, token):
+    queries = context.bot_data.get("search_queries", OrderedDict())
+    if token in queries:
+        queries.move_to_end(token)
+    return queries.get(token)
+
+async def show_events_page(query, event_type, cursor=None, direction="next"):
+    page, events_text = render_events(event_type, cursor, direction)
+    
+    if not page.events:
+        await query.edit_message_text(
+            f"❌ События типа '<b>{event_type}</b>' не найдены", 
+            parse_mode='HTML',
+            reply_markup=get_back_keyboard()
+        )
+        return
+    
+    title = "Все события" if event_type == "all" else f"События типа: {event_type}"
+    await query.edit_message_text(
+        f"🎯 <b>{title}</b>\n\n" + events_text,
+        parse_mode='HTML',
+        reply_markup=get_events_page_keyboard(page, event_type)
+    )
+
+@cached("render_stats")
+def render_stats():
+    return format_stats(get_stats())
+
+@cached("render_types")
+def render_types():
+    return format_event_types(get_event_types())
 
 # --- Команды бота ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -27,7 +131,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/types - Показать типы событий\n"
         "/update - Обновить данные (запустить парсер)\n"
         "/stats - Статистика\n"
+        "/subscribe - Подписаться на тип события или слово\n"
+        "/unsubscribe - Отписаться\n"
+        "/subscriptions - Мои подписки\n"
         "/help - Эта справка\n\n"
+        f"💬 В любом чате: <code>@{context.bot.username} хакатон</code> — поиск по мере ввода\n\n"
         "🔍 <b>Примеры поиска:</b>\n"
         "• <code>/search хакатон</code>\n"
         "• <code>/search олимпиада программирование</code>\n"
@@ -52,8 +160,7 @@ async def show_events(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def show_types(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    event_types = get_event_types()
-    types_text = format_event_types(event_types)
+    types_text = render_types()
     await update.message.reply_html(types_text, reply_markup=get_back_keyboard())
 
 async def update_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -62,7 +169,7 @@ async def update_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🔄 Запускаю парсер... Это может занять несколько минут..."
     )
     
-    success, output = run_parser()
+    success, output = await run_parser(progress_updater(message))
     
     if success:
         if len(output) > 1000:
@@ -70,13 +177,13 @@ async def update_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         result_message = await message.edit_text(
             f"✅ <b>Данные успешно обновлены!</b>\n\n"
-            f"<code>{output}</code>",
+            f"<code>{html.escape(output)}</code>",
             parse_mode='HTML'
         )
     else:
         result_message = await message.edit_text(
             f"❌ <b>Ошибка при обновлении данных:</b>\n\n"
-            f"<code>{output}</code>",
+            f"<code>{html.escape(output[-1000:])}</code>",
             parse_mode='HTML'
         )
     
@@ -91,9 +198,15 @@ async def update_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_main_keyboard()
     )
 
+def is_admin(update):
+    return update.effective_user is not None and update.effective_user.id in ADMIN_IDS
+
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    stats = get_stats()
-    stats_text = format_stats(stats)
+    stats_text = render_stats()
+    if is_admin(update):
+        # Отчёт пишет парсер после каждого прогона, с поколением данных он не связан — читаем без кэша
+        report = load_report()
+        stats_text += format_slow_sources(report, slowest_sources(report) if report else [])
     await update.message.reply_html(stats_text, reply_markup=get_back_keyboard())
 
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -109,19 +222,72 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     search_query = " ".join(context.args)
-    events_df = search_events(search_query)
+    page, events_text = render_search(search_query)
     
-    if events_df.empty:
+    if not page.events:
         await update.message.reply_html(
-            f"❌ По запросу '<b>{search_query}</b>' ничего не найдено",
+            f"❌ По запросу '<b>{format_query(search_query)}</b>' ничего не найдено",
             reply_markup=get_back_keyboard()
         )
         return
     
-    message = f"🔍 <b>Результаты поиска по запросу:</b> '{search_query}'\n\n"
-    message += format_events_list(events_df)
+    message = f"🔍 <b>Результаты поиска по запросу:</b> '{format_query(search_query)}'\n\n"
+    message += events_text
     
-    await update.message.reply_html(message, reply_markup=get_back_keyboard())
+    token = remember_search(context, search_query)
+    await update.message.reply_html(message, reply_markup=get_search_page_keyboard(page, token))
+
+# --- Подписки ---
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["notifier"].store
+    if not context.args:
+        await update.message.reply_html(format_subscriptions(store.list(update.effective_chat.id)),
+                                        reply_markup=get_back_keyboard())
+        return
+
+    value = " ".join(context.args).lower()
+    # Название типа из базы — подписка на тип, иначе на слово в заголовке или описании
+    kind = KIND_TYPE if value in {t.lower() for t in get_event_types()} else KIND_KEYWORD
+    added = store.add(update.effective_chat.id, kind, value)
+    what = "тип" if kind == KIND_TYPE else "слово"
+    text = (f"🔔 Подписка на {what} <b>{html.escape(value)}</b> оформлена. Новые события придут сюда."
+            if added else f"ℹ️ Вы уже подписаны на <b>{html.escape(value)}</b>")
+    await update.message.reply_html(text, reply_markup=get_back_keyboard())
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["notifier"].store
+    value = " ".join(context.args).lower() if context.args else None
+    if value in (None, "all", "все"):
+        removed = store.remove(update.effective_chat.id)
+        text = "🔕 Все подписки отменены" if removed else "ℹ️ У вас нет подписок"
+    else:
+        removed = store.remove(update.effective_chat.id, value)
+        text = (f"🔕 Подписка на <b>{html.escape(value)}</b> отменена" if removed
+                else f"ℹ️ Подписки на <b>{html.escape(value)}</b> нет")
+    await update.message.reply_html(text, reply_markup=get_back_keyboard())
+
+async def subscriptions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    store = context.bot_data["notifier"].store
+    await update.message.reply_html(format_subscriptions(store.list(update.effective_chat.id)),
+                                    reply_markup=get_back_keyboard())
+
+# --- Inline-режим ---
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Индекс строится в post_init; пока его нет, ответ пустой
+    index = context.bot_data.get("inline_index")
+    ids = index.search(update.inline_query.query, INLINE_RESULTS) if index else []
+    results = [
+        InlineQueryResultArticle(
+            id=str(event['id']),
+            title=(event['title'] or "Без названия")[:100],
+            description=f"📅 {event['date'] or 'Дата не указана'} | 🏷️ {event['detected_type'] or 'Не определен'}",
+            input_message_content=InputTextMessageContent(
+                event_block(event).rstrip(), parse_mode='HTML', disable_web_page_preview=True
+            ),
+        )
+        for event in get_events_by_ids(ids)
+    ]
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
 
 # --- Обработчики callback ---
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -141,13 +307,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     elif data == "all_events":
-        events_df = get_events_by_type("all", limit=10)
-        message = format_events_list(events_df)
-        await query.edit_message_text(
-            message, 
-            parse_mode='HTML',
-            reply_markup=get_back_keyboard()
-        )
+        await show_events_page(query, "all")
     
     elif data == "search_events":
         await query.edit_message_text(
@@ -160,12 +320,12 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data == "update_data":
         # Без кнопки "Назад" во время процесса обновления
-        await query.edit_message_text(
+        status_message = await query.edit_message_text(
             "🔄 Запускаю парсер...",
             reply_markup=None  # Убираем все кнопки
         )
         
-        success, output = run_parser()
+        success, output = await run_parser(progress_updater(status_message))
         
         if success:
             result_message = await query.edit_message_text(
@@ -210,27 +370,25 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif data.startswith("type_"):
-        event_type = data[5:]  
-        if event_type == "all":
-            events_df = get_events_by_type(limit=10)
-            title = "Все события"
-        else:
-            events_df = get_events_by_type(event_type, limit=10)
-            title = f"События типа: {event_type}"
-        
-        if events_df.empty:
+        await show_events_page(query, data[5:])
+    
+    elif data.startswith("ev|"):
+        _, direction, event_type, cursor = parse_page_callback(data)
+        await show_events_page(query, event_type, cursor, direction)
+    
+    elif data.startswith("sr|"):
+        _, direction, token, cursor = parse_page_callback(data)
+        search_query = recall_search(context, token)
+        if search_query is None:
             await query.edit_message_text(
-                f"❌ События типа '<b>{event_type}</b>' не найдены", 
-                parse_mode='HTML',
+                "❌ Поиск устарел, повторите команду /search",
                 reply_markup=get_back_keyboard()
             )
             return
         
-        message = f"🎯 <b>{title}</b>\n\n"
-        message += format_events_list(events_df)
-        
+        page, events_text = render_search(search_query, cursor, direction)
         await query.edit_message_text(
-            message, 
+            f"🔍 <b>Результаты поиска по запросу:</b> '{format_query(search_query)}'\n\n" + events_text,
             parse_mode='HTML',
-            reply_markup=get_back_keyboard()
+            reply_markup=get_search_page_keyboard(page, token)
         )
@@ -0,0 +1,84 @@
+import re
+from collections import namedtuple
+
+# Окончания, которые отбрасываются у однословных терминов: "олимпиада" -> "олимпиад"
+STEM_ENDINGS = "аяоеьйы"
+
+Classification = namedtuple("Classification", ["detected_type", "excluded", "matches"])
+
+def word_stem(term):
+    term = term.lower()
+    if " " not in term and len(term) > 4 and term[-1] in STEM_ENDINGS:
+        return term[:-1]
+    return term
+
+def trie_pattern(terms):
+    """Регулярка из префиксного дерева терминов: общие префиксы проверяются один раз"""
+    trie = {}
+    for term in terms:
+        node = trie
+        for ch in term:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node):
+        ends_here = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends_here:
+            # Жадный "?" сначала пробует более длинный термин
+            return "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+class KeywordClassifier:
+    """
+    Один проход по тексту находит все ключевые слова и стоп-фразы с позициями.
+    Совпадение — вхождение основы термина как подстроки, как и раньше с `kw in text`
+    """
+
+    def __init__(self, keywords, exclude_phrases):
+        self.keywords = list(keywords)
+        self.exclude_phrases = list(exclude_phrases)
+        # основа -> [(вид, исходный термин)]
+        self._owners = {}
+        for kw in self.keywords:
+            self._owners.setdefault(word_stem(kw), []).append(("keyword", kw))
+        for phrase in self.exclude_phrases:
+            self._owners.setdefault(word_stem(phrase), []).append(("exclude", phrase))
+
+        stems = list(self._owners)
+        # Термин, совпавший на позиции, скрывает более короткие термины-префиксы на той же позиции
+        self._implied = {s: [p for p in stems if p != s and s.startswith(p)] for s in stems}
+        self._regex = re.compile("(?=(" + trie_pattern(stems) + "))")
+        self._rank = {kw: i for i, kw in enumerate(self.keywords)}
+
+    def classify(self, text):
+        text = text.lower()
+        matches = []
+        hit_keywords = set()
+        excluded = []
+        for m in self._regex.finditer(text):
+            stem = m.group(1)
+            start = m.start()
+            for s in [stem] + self._implied[stem]:
+                for kind, term in self._owners[s]:
+                    if kind == "keyword":
+                        hit_keywords.add(term)
+                        matches.append((term, start, start + len(s)))
+                    elif term not in excluded:
+                        excluded.append(term)
+        detected = min(hit_keywords, key=self._rank.__getitem__) if hit_keywords else ""
+        return Classification(detected, excluded, matches)
+
+    def classify_event(self, event):
+        return self.classify(event.get("title", "") + " " + event.get("description", ""))
+
+    def classify_many(self, events):
+        return [self.classify_event(e) for e in events]
+
+    def has_keyword(self, text):
+        return bool(self.classify(text).detected_type)
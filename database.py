@@ -1,64 +1,276 @@
 import sqlite3
-import pandas as pd
+import threading
+import functools
+import re
 import os
+from collections import OrderedDict, namedtuple
 from dotenv import load_dotenv
+from snapshots import open_snapshot, snapshot_id
 
 load_dotenv()
 
 DB_NAME = os.getenv('DB_NAME')
 TABLE_NAME = os.getenv('TABLE_NAME')
 
+# --- Соединение ---
+# Одно долгоживущее read-only соединение на процесс бота: sqlite3 кэширует
+# подготовленные запросы внутри соединения, поэтому тексты SQL ниже — константы.
+# Парсер не пишет в DB_NAME, а подменяет файл готовым снимком (snapshots.SnapshotWriter):
+# соединение читает свой снимок без блокировок и переоткрывается, когда опубликован новый
+_conn = None
+_snapshot = None
+_lock = threading.Lock()
+
+def get_connection():
+    global _conn, _snapshot, _data_version
+    current = snapshot_id(DB_NAME)
+    if _conn is not None and current != _snapshot:
+        _conn.close()
+        _conn = None
+    if _conn is None:
+        _conn = open_snapshot(DB_NAME)
+        _conn.row_factory = sqlite3.Row
+        _snapshot = current
+        # data_version считается для каждого соединения отдельно: поколение перечитываем
+        _data_version = None
+    return _conn
+
+def close_connection():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+def fetch_all(query, params=()):
+    with _lock:
+        return get_connection().execute(query, params).fetchall()
+
+def fetch_one(query, params=()):
+    with _lock:
+        return get_connection().execute(query, params).fetchone()
+
+# --- Кэш результатов ---
+# Парсер увеличивает meta.generation в той же транзакции, что и запись событий.
+# Ключи кэша включают поколение, поэтому после загрузки новых данных старые ответы не используются
+CACHE_SIZE = 256
+GENERATION_SQL = "SELECT value FROM meta WHERE key = 'generation'"
+
+_cache = OrderedDict()
+_data_version = None
+_generation = 0
+
+def get_generation():
+    global _data_version, _generation
+    # data_version меняется только после коммита другого соединения (база до первой публикации снимка)
+    # или сбрасывается при переходе на новый снимок — meta перечитываем лишь тогда
+    data_version = fetch_one("PRAGMA data_version")[0]
+    if data_version != _data_version:
+        _data_version = data_version
+        try:
+            row = fetch_one(GENERATION_SQL)
+        except sqlite3.OperationalError:
+            row = None
+        _generation = int(row[0]) if row else 0
+    return _generation
+
+def cached(kind):
+    """LRU-кэш результата функции до следующего поколения данных"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            generation = get_generation()
+            key = (generation, kind, args, tuple(sorted(kwargs.items())))
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+            if _cache and next(reversed(_cache))[0] != generation:
+                # Данные обновились: все старые записи уже недостижимы
+                _cache.clear()
+            result = func(*args, **kwargs)
+            _cache[key] = result
+            if len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+            return result
+        return wrapper
+    return decorator
+
+# --- Запросы ---
+# Почти дубликаты (см. parser.assign_canonical_ids) в списки и счётчики не попадают.
+# Выражение совпадает с условием частичных индексов parser.init_indexes
+CANONICAL_WHERE = "(canonical_id IS NULL OR canonical_id = id)"
+EVENT_TYPES_SQL = f"SELECT DISTINCT detected_type FROM {TABLE_NAME} WHERE detected_type != ''"
+FTS_TABLE = f"{TABLE_NAME}_fts"
+# \x02/\x03 — маркеры подсветки, formatters заменяет их на <b></b> после экранирования
+SEARCH_MATCHES_SQL = f"""
+    SELECT e.*, snippet({FTS_TABLE}, -1, char(2), char(3), '…', 12) AS snippet,
+           bm25({FTS_TABLE}, 2.0, 1.0) AS score
+    FROM {FTS_TABLE} JOIN {TABLE_NAME} AS e ON e.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH ? AND (e.canonical_id IS NULL OR e.canonical_id = e.id)
+"""
+# Запасной поиск для базы без миграций парсера: только исходные колонки таблицы
+SEARCH_LIKE_SQL = f"""
+    SELECT * FROM {TABLE_NAME}
+    WHERE title LIKE ? OR description LIKE ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+# Один проход по индексу (detected_type, date_iso): число событий и последняя дата по каждому типу
+STATS_SQL = f"""
+    SELECT detected_type, COUNT(*) AS count, MAX(date_iso) AS last_date
+    FROM {TABLE_NAME}
+    WHERE {CANONICAL_WHERE}
+    GROUP BY detected_type
+    ORDER BY count DESC
+"""
+
+# --- Постраничный вывод ---
+# Keyset-пагинация: курсор — ключ сортировки крайней строки страницы, а не OFFSET,
+# поэтому любая страница стоит как первая. direction: "next" — дальше по списку, "prev" — назад
+Page = namedtuple("Page", ["events", "next_cursor", "prev_cursor"])
+PAGE_SIZE = 10
+
+@functools.lru_cache(maxsize=None)
+def events_page_sql(by_type, direction, with_cursor):
+    # date_iso — нормализованная парсером дата; порядок берётся прямо из частичных индексов
+    # (detected_type, date_iso) и (date_iso) по каноническим событиям
+    where = [CANONICAL_WHERE]
+    if by_type:
+        where.append("detected_type = ?")
+    if with_cursor:
+        where.append("(date_iso, id) < (?, ?)" if direction == "next" else "(date_iso, id) > (?, ?)")
+    order = "DESC" if direction == "next" else "ASC"
+    where_sql = " WHERE " + " AND ".join(where)
+    return f"SELECT * FROM {TABLE_NAME}{where_sql} ORDER BY date_iso {order}, id {order} LIMIT ?"
+
+@functools.lru_cache(maxsize=None)
+def search_page_sql(direction, with_cursor):
+    # Меньший bm25 — более релевантный результат
+    where = ""
+    if with_cursor:
+        where = " WHERE (score, id) > (?, ?)" if direction == "next" else " WHERE (score, id) < (?, ?)"
+    order = "ASC" if direction == "next" else "DESC"
+    return f"SELECT * FROM ({SEARCH_MATCHES_SQL}){where} ORDER BY score {order}, id {order} LIMIT ?"
+
+def make_page(rows, limit, cursor, direction, key):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+    if direction == "next":
+        return Page(rows, key(rows[-1]) if has_more else None, key(rows[0]) if cursor else None)
+    return Page(rows, key(rows[-1]), key(rows[0]) if has_more else None)
+
+def trim_page(page, count, direction, key):
+    """
+    Оставляет count событий страницы, если целиком она не помещается в сообщение.
+    Отбрасываются события дальше по ходу листания, курсор сдвигается на последнее показанное
+    """
+    if count >= len(page.events):
+        return page
+    if direction == "prev":
+        events = page.events[-count:]
+        return Page(events, page.next_cursor, key(events[0]))
+    events = page.events[:count]
+    return Page(events, key(events[-1]), page.prev_cursor)
+
+def list_key(row):
+    return (row['date_iso'], row['id'])
+
+@cached("events_page")
+def get_events_page(event_type=None, cursor=None, direction="next", limit=PAGE_SIZE):
+    by_type = bool(event_type and event_type != "all")
+    params = ((event_type,) if by_type else ()) + (tuple(cursor) if cursor else ()) + (limit + 1,)
+    rows = fetch_all(events_page_sql(by_type, direction, cursor is not None), params)
+    return make_page(rows, limit, cursor, direction, list_key)
+
 def get_events_by_type(event_type=None, limit=10):
-    conn = sqlite3.connect(DB_NAME)
-    
-    if event_type and event_type != "all":
-        query = f"SELECT * FROM {TABLE_NAME} WHERE detected_type = ? ORDER BY date DESC LIMIT ?"
-        df = pd.read_sql_query(query, conn, params=(event_type, limit))
-    else:
-        query = f"SELECT * FROM {TABLE_NAME} ORDER BY date DESC LIMIT ?"
-        df = pd.read_sql_query(query, conn, params=(limit,))
-    
-    conn.close()
-    return df
+    return get_events_page(event_type, limit=limit).events
 
+@cached("types")
 def get_event_types():
-    conn = sqlite3.connect(DB_NAME)
-    query = f"SELECT DISTINCT detected_type FROM {TABLE_NAME} WHERE detected_type != ''"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df['detected_type'].tolist()
+    return [row[0] for row in fetch_all(EVENT_TYPES_SQL)]
+
+# --- Поиск ---
+# Окончания русских слов, от длинных к коротким; слово ищется по основе как по префиксу
+RU_ENDINGS = sorted([
+    "иями", "ями", "ами", "ыми", "ими", "ого", "его", "ому", "ему", "ых", "их",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ую", "юю", "ые", "ие",
+    "ах", "ях", "ов", "ев", "ом", "ем", "ам", "ям", "ию", "ия", "ии", "ью",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й"
+], key=len, reverse=True)
+MIN_STEM = 4
+
+def search_stem(word):
+    for ending in RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+def build_match_query(query):
+    """'олимпиада программирование' -> '"олимпиад"* "программировани"*' (все слова обязательны)"""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join(f'"{search_stem(w)}"*' for w in words)
+
+def search_key(row):
+    return (row['score'], row['id'])
+
+@cached("search_page")
+def search_events_page(query, cursor=None, direction="next", limit=PAGE_SIZE):
+    match = build_match_query(query)
+    if not match:
+        return Page([], None, None)
+    params = (match,) + (tuple(cursor) if cursor else ()) + (limit + 1,)
+    try:
+        rows = fetch_all(search_page_sql(direction, cursor is not None), params)
+    except sqlite3.OperationalError:
+        # База ещё не пересобрана парсером с полнотекстовым индексом: только первая страница
+        return Page(fetch_all(SEARCH_LIKE_SQL, (f'%{query}%', f'%{query}%', limit)), None, None)
+    return make_page(rows, limit, cursor, direction, search_key)
 
 def search_events(query, limit=10):
-    conn = sqlite3.connect(DB_NAME)
-    search_query = f"""
-    SELECT * FROM {TABLE_NAME} 
-    WHERE title LIKE ? OR description LIKE ? 
-    ORDER BY date DESC 
-    LIMIT ?
-    """
-    df = pd.read_sql_query(search_query, conn, params=(f'%{query}%', f'%{query}%', limit))
-    conn.close()
-    return df
+    return search_events_page(query, limit=limit).events
 
+@cached("stats")
 def get_stats():
-    conn = sqlite3.connect(DB_NAME)
-    
-    total_events = pd.read_sql_query(f"SELECT COUNT(*) as count FROM {TABLE_NAME}", conn).iloc[0]['count']
-    
-    type_stats = pd.read_sql_query(
-        f"SELECT detected_type, COUNT(*) as count FROM {TABLE_NAME} GROUP BY detected_type ORDER BY count DESC", 
-        conn
-    )
-    
-    last_update = pd.read_sql_query(
-        f"SELECT MAX(date) as last_date FROM {TABLE_NAME} WHERE date != ''", 
-        conn
-    ).iloc[0]['last_date']
-    
-    conn.close()
-    
+    type_stats = fetch_all(STATS_SQL)
+    last_dates = [row['last_date'] for row in type_stats if row['last_date']]
     return {
-        'total_events': total_events,
+        'total_events': sum(row['count'] for row in type_stats),
         'type_stats': type_stats,
-        'last_update': last_update
+        'last_update': max(last_dates) if last_dates else None
     }
+
+# --- Новые события для рассылки ---
+# id растёт только при вставке (upsert обновляет строку на месте), поэтому новые события — id больше отметки
+NEW_EVENTS_SQL = f"""
+    SELECT * FROM {TABLE_NAME}
+    WHERE id > ? AND id <= ? AND {CANONICAL_WHERE}
+    ORDER BY id
+    LIMIT ?
+"""
+MAX_ID_SQL = f"SELECT COALESCE(MAX(id), 0) FROM {TABLE_NAME}"
+
+def get_max_event_id():
+    return fetch_one(MAX_ID_SQL)[0]
+
+def get_events_between(after_id, up_to_id, limit=500):
+    """Канонические события с after_id < id <= up_to_id по возрастанию id"""
+    return fetch_all(NEW_EVENTS_SQL, (after_id, up_to_id, limit))
+
+# --- Inline-поиск ---
+# Строки для inline_index: индекс сравнивает их с уже проиндексированными и переиндексирует только изменённые
+INDEX_ROWS_SQL = f"SELECT id, title, date, date_iso, detected_type FROM {TABLE_NAME} WHERE {CANONICAL_WHERE}"
+
+def get_index_rows():
+    return [tuple(row) for row in fetch_all(INDEX_ROWS_SQL)]
+
+def get_events_by_ids(ids):
+    """События по id в порядке ids (пропавшие из базы пропускаются)"""
+    if not ids:
+        return []
+    placeholders = ",".join("?" * len(ids))
+    rows = {row['id']: row for row in fetch_all(f"SELECT * FROM {TABLE_NAME} WHERE id IN ({placeholders})", tuple(ids))}
+    return [rows[i] for i in ids if i in rows]
@@ -0,0 +1,64 @@
+import hashlib
+import operator
+import re
+import zlib
+from array import array
+
+# MinHash-подписи и LSH-корзины для поиска почти одинаковых событий из разных источников.
+# 16 полос по 4 значения: пара с похожестью по Жаккару ~0.5 и выше почти наверняка
+# попадает хотя бы в одну общую корзину, поэтому сравнивать со всей базой не нужно
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 2
+SIMILARITY_THRESHOLD = 0.6
+# Сколько последних событий брать из одной корзины: похожие формулировки одной ленты
+# забивают корзины, и без ограничения каждое новое событие сравнивалось бы со всеми
+BUCKET_CANDIDATES = 8
+# Меняется вместе со способом подсчёта подписи: старые подписи пересчитываются (parser.migrate_dedup)
+MINHASH_VERSION = 2
+
+WORD_RE = re.compile(r"\w+")
+
+def normalize_text(text):
+    """Нижний регистр, только слова: «›››», кавычки и пунктуация не влияют на сравнение"""
+    return " ".join(WORD_RE.findall(text.lower().replace("ё", "е")))
+
+def shingles(text):
+    words = normalize_text(text).split()
+    if len(words) < SHINGLE_SIZE:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def event_text(title, description):
+    return f"{title or ''} {description or ''}"
+
+def minhash(text):
+    """
+    Подпись из NUM_PERM минимумов; None, если в тексте нет слов.
+    NUM_PERM хэш-функций — 32-битные слова одного вывода SHAKE-128 по шинглу, минимумы берутся срезами массива
+    """
+    digests = b"".join(hashlib.shake_128(s.encode("utf-8")).digest(NUM_PERM * 4) for s in shingles(text))
+    if not digests:
+        return None
+    values = array("I", digests)
+    return array("I", [min(values[i::NUM_PERM]) for i in range(NUM_PERM)])
+
+def band_buckets(signature):
+    """Номер корзины для каждой полосы подписи"""
+    return [
+        zlib.crc32(signature[band * ROWS:(band + 1) * ROWS].tobytes())
+        for band in range(BANDS)
+    ]
+
+def similarity(sig_a, sig_b):
+    """Оценка похожести по Жаккару: доля совпавших минимумов"""
+    return sum(map(operator.eq, sig_a, sig_b)) / NUM_PERM
+
+def to_blob(signature):
+    return signature.tobytes()
+
+def from_blob(blob):
+    signature = array("I")
+    signature.frombytes(blob)
+    return signature
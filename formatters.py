@@ -1,18 +1,82 @@
-def format_events_list(events_df):
-    if events_df.empty:
+import html
+import time
+
+def format_snippet(snippet):
+    # Подсветка от FTS приходит маркерами \x02/\x03, чтобы не смешивать её с текстом страницы
+    return html.escape(snippet).replace("\x02", "<b>").replace("\x03", "</b>")
+
+# Лимит длины одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+# Под заголовок, который обработчик ставит перед списком («События типа: …», текст запроса)
+HEADER_RESERVE = 300
+LIST_HEADER = "📅 <b>Найденные события:</b>\n\n"
+TITLE_LIMIT = 300
+QUERY_LIMIT = 100
+
+def render_event_fragment(event):
+    """
+    HTML-блок события без номера. Парсер считает его один раз при записи и хранит
+    в колонке fragment, бот только склеивает готовые блоки
+    """
+    title = html.escape((event['title'] or "Без названия")[:TITLE_LIMIT])
+    date = html.escape(event['date'] or "Дата не указана")
+    event_type = html.escape(event['detected_type'] or "Не определен")
+    return (
+        f"<b>{title}</b>\n"
+        f"   📅 {date} | 🏷️ {event_type}\n"
+        f"   🔗 <a href='{html.escape(event['link'])}'>Подробнее</a>\n"
+    )
+
+def event_block(event):
+    # В базе, ещё не обновлённой парсером, колонки fragment нет
+    if "fragment" in event.keys() and event['fragment']:
+        block = event['fragment']
+    else:
+        block = render_event_fragment(event)
+    if "snippet" in event.keys() and event['snippet']:
+        block += f"   💬 {format_snippet(event['snippet'])}\n"
+    return block + "\n"
+
+def number_prefix(idx):
+    return f"{idx + 1}. "
+
+def fit_count(events, limit=MESSAGE_LIMIT - HEADER_RESERVE, from_end=False):
+    """Сколько событий подряд (с начала или с конца) помещается в одно сообщение; минимум одно"""
+    size = len(LIST_HEADER)
+    count = 0
+    ordered = reversed(events) if from_end else events
+    for event in ordered:
+        # Номер не длиннее "99. "
+        size += len(event_block(event)) + 4
+        if size > limit and count:
+            break
+        count += 1
+    return count
+
+def pack_messages(header, blocks, limit=MESSAGE_LIMIT):
+    """Раскладывает готовые блоки по сообщениям не длиннее limit; header — в начале первого"""
+    messages = []
+    current = [header]
+    size = len(header)
+    for block in blocks:
+        if size + len(block) > limit and size:
+            messages.append("".join(current))
+            current, size = [], 0
+        current.append(block)
+        size += len(block)
+    messages.append("".join(current))
+    return messages
+
+def format_query(query):
+    """Текст запроса для заголовка: экранирован и обрезан, чтобы не съесть лимит сообщения"""
+    if len(query) > QUERY_LIMIT:
+        query = query[:QUERY_LIMIT] + "…"
+    return html.escape(query)
+
+def format_events_list(events):
+    if not events:
         return "❌ События не найдены"
-    
-    message = "📅 <b>Найденные события:</b>\n\n"
-    for idx, event in events_df.iterrows():
-        title = event['title'] or "Без названия"
-        date = event['date'] or "Дата не указана"
-        event_type = event['detected_type'] or "Не определен"
-        
-        message += f"{idx + 1}. <b>{title}</b>\n"
-        message += f"   📅 {date} | 🏷️ {event_type}\n"
-        message += f"   🔗 <a href='{event['link']}'>Подробнее</a>\n\n"
-    
-    return message
+    return LIST_HEADER + "".join(number_prefix(idx) + event_block(event) for idx, event in enumerate(events))
 
 def format_stats(stats):
     if stats['total_events'] == 0:
@@ -22,13 +86,14 @@ def format_stats(stats):
     stats_text += f"📊 Всего событий: <b>{stats['total_events']}</b>\n"
     
     if stats['last_update']:
-        stats_text += f"📅 Последнее обновление: <b>{stats['last_update']}</b>\n\n"
+        year, month, day = stats['last_update'].split("-")
+        stats_text += f"📅 Последнее обновление: <b>{day}.{month}.{year}</b>\n\n"
     else:
         stats_text += "\n"
     
     stats_text += "<b>Распределение по типам:</b>\n"
     
-    for _, row in stats['type_stats'].iterrows():
+    for row in stats['type_stats']:
         stats_text += f"• {row['detected_type']}: <b>{row['count']}</b>\n"
     
     return stats_text
@@ -42,3 +107,56 @@ def format_event_types(event_types):
     )
     
     return types_text
+
+def format_progress(progress):
+    if not progress.get('sources_total'):
+        return "🔄 Запускаю парсер..."
+    return (
+        f"🔄 Обновление данных...\n"
+        f"Источников обработано: {progress['sources_done']}/{progress['sources_total']}\n"
+        f"Найдено событий: {progress['events_found']}"
+    )
+
+def format_slow_sources(report, sources):
+    """Админский блок /stats: самые медленные источники по последнему прогону парсера"""
+    if not report:
+        return "\n🐢 Метрик обхода пока нет: парсер ещё не запускался"
+
+    started = time.strftime("%d.%m.%Y %H:%M", time.localtime(report['started_at']))
+    text = (
+        f"\n🐢 <b>Медленные источники</b> (прогон {started}, "
+        f"{report['duration_ms'] / 1000:.1f} с):\n"
+    )
+    for src in sources:
+        text += (
+            f"• {html.escape(src['name'])}: загрузка <b>{src['fetch_ms'] / 1000:.1f} с</b>, "
+            f"разбор {src['parse_ms'] / 1000:.2f} с, страниц {src['pages']}, "
+            f"ошибок {src['failed']}, {src['bytes'] // 1024} КБ\n"
+        )
+    stages = report['stages']
+    text += (
+        f"Стадии: загрузка {stages['fetch_ms'] / 1000:.1f} с, разбор {stages['parse_ms'] / 1000:.2f} с, "
+        f"фильтрация {stages['classify_ms'] / 1000:.2f} с, запись {stages['db_write_ms'] / 1000:.2f} с, "
+        f"склейка дубликатов {stages.get('dedup_ms', 0) / 1000:.2f} с"
+    )
+    return text
+
+def format_notification(events):
+    """Новые события для подписчика; список сообщений, каждое не длиннее MESSAGE_LIMIT"""
+    return pack_messages(
+        "🔔 <b>Новые события по вашим подпискам:</b>\n\n",
+        [number_prefix(idx) + event_block(event) for idx, event in enumerate(events)]
+    )
+
+def format_subscriptions(rows):
+    if not rows:
+        return (
+            "🔕 У вас нет подписок.\n\n"
+            "Подпишитесь на тип события или слово:\n"
+            "<code>/subscribe хакатон</code>\n"
+            "<code>/subscribe машинное обучение</code>"
+        )
+    kinds = {"type": "тип", "keyword": "слово"}
+    return "🔔 <b>Ваши подписки:</b>\n\n" + "\n".join(
+        f"• {html.escape(value)} ({kinds.get(kind, kind)})" for kind, value in rows
+    )
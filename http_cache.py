@@ -0,0 +1,121 @@
+import sqlite3
+import hashlib
+import threading
+import time
+
+CACHE_DB = "http_cache.db"
+
+class HttpCache:
+    """Дисковый кэш ответов: ETag/Last-Modified и хэш тела по каждому URL"""
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                body TEXT,
+                fetched_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, body_hash, body FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "body_hash": row[2], "body": row[3]}
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def put(self, url, etag, last_modified, body):
+        """Сохраняет ответ, возвращает True если тело изменилось с прошлой загрузки"""
+        changed = self.stage(url, etag, last_modified, body)
+        self.commit_pending([url])
+        return changed
+
+    def stage(self, url, etag, last_modified, body):
+        """
+        Запоминает ответ до commit_pending(), возвращает True если тело изменилось с последнего
+        сохранённого. Пока события страницы не записаны, кэш не должен считать её разобранной
+        """
+        body_hash = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        with self._lock:
+            row = self._conn.execute("SELECT body_hash FROM responses WHERE url = ?", (url,)).fetchone()
+            self._pending[url] = (url, etag, last_modified, body_hash, body, time.time())
+        return row is None or row[0] != body_hash
+
+    def commit_pending(self, urls=None):
+        """Сохраняет отложенные ответы (все или только urls)"""
+        with self._lock:
+            urls = list(self._pending) if urls is None else urls
+            rows = [self._pending.pop(url) for url in urls if url in self._pending]
+            self._conn.executemany("""
+                INSERT INTO responses (url, etag, last_modified, body_hash, body, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    body_hash = excluded.body_hash,
+                    body = excluded.body,
+                    fetched_at = excluded.fetched_at
+            """, rows)
+            self._conn.commit()
+
+    def discard_pending(self):
+        """Прогон не сохранён: следующий снова загрузит и разберёт эти страницы"""
+        with self._lock:
+            self._pending.clear()
+
+    def touch(self, url):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+
+class DetailCache:
+    """Дата и полное описание со страницы события: каждая страница загружается один раз"""
+
+    def __init__(self, path=CACHE_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS details (
+                link TEXT PRIMARY KEY,
+                date_iso TEXT,
+                description TEXT,
+                fetched_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, link):
+        with self._lock:
+            row = self._conn.execute("SELECT date_iso, description FROM details WHERE link = ?", (link,)).fetchone()
+        if not row:
+            return None
+        return {"date_iso": row[0], "description": row[1]}
+
+    def put(self, link, date_iso, description):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO details (link, date_iso, description, fetched_at) VALUES (?, ?, ?, ?)",
+                (link, date_iso, description, time.time())
+            )
+            self._conn.commit()
@@ -0,0 +1,164 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import re
+from datetime import date as date_cls
+from database import get_index_rows
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"\w+")
+# Сколько подходящих событий (от новых к старым) ранжируется на один запрос
+CANDIDATE_LIMIT = 150
+# Сколько слов префикса ещё выгодно сливать по спискам событий
+MERGE_WORDS = 64
+
+def tokenize(text):
+    return WORD_RE.findall((text or "").lower().replace("ё", "е"))
+
+def order_key(date_iso, event_id):
+    """Целый ключ сортировки: меньше — новее (по date_iso, затем по id, как в списках бота)"""
+    try:
+        days = date_cls.fromisoformat(date_iso).toordinal() if date_iso else 0
+    except ValueError:
+        days = 0
+    return -(days * 10**10 + event_id)
+
+class InlineIndex:
+    """
+    Префиксный индекс по словам заголовка и типа событий для inline-поиска.
+    Слова лежат в отсортированном списке, поэтому все слова с данным префиксом — один срез через bisect;
+    у каждого слова отсортированный по новизне список ключей событий
+    """
+
+    def __init__(self):
+        self.words = []           # отсортированные различные слова
+        self.postings = {}        # слово -> отсортированный список ключей событий
+        self.entries = {}         # ключ -> (id, тип события в нижнем регистре)
+        self.event_text = {}      # ключ -> " слово1 слово2 ... ": проверка префикса — поиск подстроки " префикс"
+        self.keys = {}            # id -> ключ
+        self.fingerprints = {}    # id -> строка из базы, по которой индексировалось событие
+        self.recent = []          # все ключи от новых к старым
+        self._lock = asyncio.Lock()
+
+    # --- Построение и обновление ---
+    @classmethod
+    def build(cls, rows):
+        index = cls()
+        for row in rows:
+            index._add(row, sort=False)
+        index.words = sorted(index.postings)
+        for postings in index.postings.values():
+            postings.sort()
+        index.recent.sort()
+        return index
+
+    def _add(self, row, sort=True):
+        event_id, title, date, date_iso, detected_type = row
+        key = order_key(date_iso, event_id)
+        words = tuple(set(tokenize(title) + tokenize(detected_type)))
+        self.entries[key] = (event_id, " ".join(tokenize(detected_type)))
+        self.event_text[key] = f" {' '.join(words)} "
+        self.keys[event_id] = key
+        self.fingerprints[event_id] = tuple(row)
+        for word in words:
+            postings = self.postings.get(word)
+            if postings is None:
+                self.postings[word] = [key]
+                if sort:
+                    bisect.insort(self.words, word)
+            elif sort:
+                bisect.insort(postings, key)
+            else:
+                postings.append(key)
+        if sort:
+            bisect.insort(self.recent, key)
+        else:
+            self.recent.append(key)
+
+    def _remove(self, event_id):
+        key = self.keys.pop(event_id)
+        del self.fingerprints[event_id]
+        del self.entries[key]
+        for word in self.event_text.pop(key).split():
+            postings = self.postings[word]
+            del postings[bisect.bisect_left(postings, key)]
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+        del self.recent[bisect.bisect_left(self.recent, key)]
+
+    def apply(self, rows):
+        """Переиндексирует только новые, изменённые и пропавшие события; возвращает число изменений"""
+        current = {row[0]: tuple(row) for row in rows}
+        changed = 0
+        for event_id in [i for i in self.fingerprints if i not in current]:
+            self._remove(event_id)
+            changed += 1
+        for event_id, row in current.items():
+            if self.fingerprints.get(event_id) == row:
+                continue
+            if event_id in self.fingerprints:
+                self._remove(event_id)
+            self._add(row)
+            changed += 1
+        return changed
+
+    async def on_refresh(self, source, result):
+        """Колбэк RefreshManager: чтение базы в потоке, правка индекса — в цикле событий"""
+        if not result or not (result.get("inserted") or result.get("updated")):
+            return
+        # Параллельные обновления разных источников: чтение и правка по очереди, чтобы старый снимок не лёг поверх нового
+        async with self._lock:
+            rows = await asyncio.to_thread(get_index_rows)
+            changed = self.apply(rows)
+        logger.info("Inline-индекс обновлён: изменено событий %d", changed)
+
+    # --- Поиск ---
+    def prefix_words(self, prefix):
+        lo = bisect.bisect_left(self.words, prefix)
+        hi = bisect.bisect_left(self.words, prefix + "￿")
+        return self.words[lo:hi]
+
+    def search(self, query, limit=50):
+        """id событий, у которых каждое слово запроса — префикс одного из слов заголовка или типа"""
+        terms = tokenize(query)
+        if not terms:
+            return [self.entries[key][0] for key in self.recent[:limit]]
+
+        # Обходим события самого редкого префикса от новых к старым, остальные слова проверяем у события
+        matches = {term: self.prefix_words(term) for term in terms}
+        sizes = {term: sum(len(self.postings[word]) for word in words) for term, words in matches.items()}
+        pivot = min(terms, key=sizes.get)
+        if not sizes[pivot]:
+            return []
+        if len(matches[pivot]) > MERGE_WORDS:
+            # Короткий префикс подходит к тысячам слов: слияние их списков дороже, чем пройти события подряд
+            keys, rest = self.recent, [" " + term for term in terms]
+        else:
+            keys = heapq.merge(*(self.postings[word] for word in matches[pivot]))
+            rest = [" " + term for term in terms if term != pivot]
+
+        candidates = []
+        last = None
+        for key in keys:
+            if key == last:
+                continue
+            last = key
+            text = self.event_text[key]
+            if all(map(text.__contains__, rest)):
+                candidates.append(key)
+                if len(candidates) >= CANDIDATE_LIMIT:
+                    break
+
+        def score(key):
+            text = self.event_text[key]
+            detected_type = self.entries[key][1]
+            # Целое слово весит больше префикса, совпадение с типом — ещё больше
+            total = sum(2 if f" {term} " in text else 1 for term in terms)
+            total += sum(2 for term in terms if detected_type.startswith(term))
+            return (-total, key)
+
+        candidates.sort(key=score)
+        return [self.entries[key][0] for key in candidates[:limit]]
@@ -37,3 +37,40 @@ def get_events_type_keyboard():
     keyboard.append([InlineKeyboardButton("⬅️ Назад в меню", callback_data="back_to_main")])
     
     return InlineKeyboardMarkup(keyboard)
+
+# --- Пагинация ---
+# callback_data (до 64 байт): "ev|<n/p>|<date_iso>|<id>|<тип>" и "sr|<n/p>|<токен запроса>|<bm25>|<id>"
+def events_page_callback(direction, cursor, event_type):
+    return f"ev|{direction}|{cursor[0]}|{cursor[1]}|{event_type}"
+
+def search_page_callback(direction, cursor, token):
+    return f"sr|{direction}|{token}|{cursor[0]!r}|{cursor[1]}"
+
+def parse_page_callback(data):
+    """Обратное к *_page_callback: (вид, направление, аргумент, курсор)"""
+    kind, direction, first, second, rest = data.split("|", 4)
+    if kind == "ev":
+        return kind, "next" if direction == "n" else "prev", rest, (first, int(second))
+    return kind, "next" if direction == "n" else "prev", first, (float(second), int(rest))
+
+def get_pagination_keyboard(prev_data=None, next_data=None):
+    nav = []
+    if prev_data:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=prev_data))
+    if next_data:
+        nav.append(InlineKeyboardButton("Дальше ➡️", callback_data=next_data))
+    keyboard = [nav] if nav else []
+    keyboard.append([InlineKeyboardButton("⬅️ Назад в меню", callback_data="back_to_main")])
+    return InlineKeyboardMarkup(keyboard)
+
+def get_events_page_keyboard(page, event_type):
+    return get_pagination_keyboard(
+        events_page_callback("p", page.prev_cursor, event_type) if page.prev_cursor else None,
+        events_page_callback("n", page.next_cursor, event_type) if page.next_cursor else None
+    )
+
+def get_search_page_keyboard(page, token):
+    return get_pagination_keyboard(
+        search_page_callback("p", page.prev_cursor, token) if page.prev_cursor else None,
+        search_page_callback("n", page.next_cursor, token) if page.next_cursor else None
+    )
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+
+METRICS_REPORT = os.getenv("METRICS_REPORT", "crawl_report.json")
+# Файл для textfile-коллектора node_exporter; пусто — не писать
+METRICS_PROM = os.getenv("METRICS_PROM", "")
+
+PAGE_COUNTERS = ("bytes", "ttfb_ms", "download_ms", "fetch_ms", "parse_ms", "candidates", "relevant")
+STAGES = ("fetch_ms", "parse_ms", "classify_ms", "enrich_ms", "db_write_ms", "dedup_ms")
+
+class CrawlMetrics:
+    """
+    Тайминги и счётчики прогона парсера по страницам и источникам.
+    Время стадий суммируется по страницам, поэтому при параллельном обходе оно больше длительности прогона
+    """
+
+    def __init__(self, sources):
+        self.source_names = [src["name"] for src in sources]
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+        self.pages = []
+        self.stages = dict.fromkeys(STAGES, 0.0)
+
+    def page(self, source_idx, url):
+        """Запись о странице; стадии обхода дописывают в неё свои значения"""
+        record = {"source": self.source_names[source_idx], "url": url, "status": None, "changed": False}
+        record.update(dict.fromkeys(PAGE_COUNTERS, 0))
+        self.pages.append(record)
+        return record
+
+    def add_stage(self, stage, ms):
+        self.stages[stage] += ms
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        for record in self.pages:
+            self.stages["fetch_ms"] += record["fetch_ms"]
+            self.stages["parse_ms"] += record["parse_ms"]
+
+    def sources_summary(self):
+        summary = {
+            name: {"name": name, "run_at": self.started_at, "pages": 0, "failed": 0, **dict.fromkeys(PAGE_COUNTERS, 0)}
+            for name in self.source_names
+        }
+        for record in self.pages:
+            source = summary[record["source"]]
+            source["pages"] += 1
+            if record["status"] is None or record["status"] >= 400:
+                source["failed"] += 1
+            for key in PAGE_COUNTERS:
+                source[key] += record[key]
+        return list(summary.values())
+
+    def report(self):
+        return {
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0, 1),
+            "stages": {stage: round(ms, 1) for stage, ms in self.stages.items()},
+            "sources": [rounded(src) for src in self.sources_summary()],
+            "pages": [rounded(record) for record in self.pages],
+        }
+
+    def write_json(self, path=METRICS_REPORT):
+        report = self.report()
+        # Планировщик обходит источники по одному: сводку по остальным берём из прошлых прогонов
+        previous = load_report(path)
+        if previous:
+            report["sources"] += [src for src in previous.get("sources", []) if src["name"] not in self.source_names]
+        write_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+
+    def prometheus_text(self):
+        lines = [
+            "# TYPE osu_crawl_last_run_timestamp_seconds gauge",
+            f"osu_crawl_last_run_timestamp_seconds {self.started_at:.0f}",
+            "# TYPE osu_crawl_duration_seconds gauge",
+            f"osu_crawl_duration_seconds {(self.duration_ms or 0) / 1000:.3f}",
+            "# TYPE osu_crawl_stage_seconds gauge",
+        ]
+        lines += [f'osu_crawl_stage_seconds{{stage="{stage[:-3]}"}} {ms / 1000:.3f}' for stage, ms in self.stages.items()]
+
+        source_metrics = (
+            ("pages", "osu_crawl_source_pages"),
+            ("failed", "osu_crawl_source_failed_pages"),
+            ("bytes", "osu_crawl_source_bytes"),
+            ("fetch_ms", "osu_crawl_source_fetch_seconds"),
+            ("parse_ms", "osu_crawl_source_parse_seconds"),
+            ("candidates", "osu_crawl_source_candidates"),
+            ("relevant", "osu_crawl_source_relevant"),
+        )
+        summary = self.sources_summary()
+        for key, name in source_metrics:
+            lines.append(f"# TYPE {name} gauge")
+            for source in summary:
+                value = source[key] / 1000 if key.endswith("_ms") else source[key]
+                lines.append(f'{name}{{source="{prometheus_label(source["name"])}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=METRICS_PROM):
+        write_atomic(path, self.prometheus_text())
+
+def rounded(record):
+    return {key: round(value, 1) if isinstance(value, float) else value for key, value in record.items()}
+
+def prometheus_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def write_atomic(path, text):
+    # Бот и коллектор не должны увидеть наполовину записанный файл
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def load_report(path=METRICS_REPORT):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def slowest_sources(report, limit=5):
+    """Источники последнего прогона по убыванию суммарного времени загрузки и разбора"""
+    sources = [src for src in report.get("sources", []) if src["pages"]]
+    sources.sort(key=lambda src: src["fetch_ms"] + src["parse_ms"], reverse=True)
+    return sources[:limit]
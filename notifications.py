@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+from database import get_max_event_id, get_events_between
+from formatters import format_notification
+from subscriptions import SubscriptionStore, KIND_TYPE, KIND_KEYWORD
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: около 30 сообщений в секунду всего и не больше одного в секунду в один чат
+GLOBAL_RATE = 25
+CHAT_INTERVAL = 1.0
+SENDERS = 8            # одновременных запросов sendMessage
+MAX_ATTEMPTS = 3       # попыток при сетевых ошибках
+NEW_EVENTS_BATCH = 500
+
+WATERMARK_KEY = "last_event_id"
+
+class BroadcastQueue:
+    """
+    Очередь исходящих сообщений. put() не ждёт отправки, поэтому обработчики не блокируются.
+    У каждого чата своя FIFO-очередь, а в общую очередь готовых попадает сам чат, когда истёк
+    его интервал: сообщения одного чата уходят по одному и в порядке постановки
+    (части одной рассылки не перемешиваются). После RetryAfter вся рассылка ставится на паузу,
+    сообщение остаётся первым в очереди своего чата
+    """
+
+    def __init__(self, bot, on_blocked=None, global_rate=GLOBAL_RATE, chat_interval=CHAT_INTERVAL, senders=SENDERS):
+        self.bot = bot
+        self.on_blocked = on_blocked
+        self.interval = 1 / global_rate
+        self.chat_interval = chat_interval
+        self.senders = senders
+        self.ready = asyncio.Queue()   # chat_id, которым можно отправлять
+        self._chats = {}               # chat_id -> deque[(text, attempt)]; чат есть, пока не истёк его интервал
+        self._next_slot = 0.0
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._sender()) for _ in range(self.senders)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put(self, chat_id, text):
+        messages = self._chats.get(chat_id)
+        if messages is not None:
+            # Чат ждёт своей очереди, отправляет или выдерживает интервал: сообщение встаёт за предыдущими
+            messages.append((text, 0))
+            return
+        self._chats[chat_id] = deque([(text, 0)])
+        self.ready.put_nowait(chat_id)
+
+    def _wake(self, chat_id):
+        # Интервал чата истёк: дальше отправлять, если за это время появились сообщения, иначе забыть чат
+        if self._chats.get(chat_id):
+            self.ready.put_nowait(chat_id)
+        else:
+            self._chats.pop(chat_id, None)
+
+    async def _sender(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self.ready.get()
+            messages = self._chats.get(chat_id)
+            if not messages:
+                continue
+            text, attempt = messages.popleft()
+            # Слот резервируется до await, поэтому параллельные отправители не превышают общий лимит
+            now = loop.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            delay = await self._send(chat_id, text, attempt)
+            loop.call_later(delay, self._wake, chat_id)
+
+    async def _send(self, chat_id, text, attempt):
+        """Отправляет сообщение; возвращает, через сколько секунд чат может получить следующее"""
+        messages = self._chats[chat_id]
+        try:
+            await self.bot.send_message(chat_id, text, parse_mode='HTML', disable_web_page_preview=True)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            loop = asyncio.get_running_loop()
+            self._next_slot = max(self._next_slot, loop.time() + delay)
+            messages.appendleft((text, attempt))
+            return delay
+        except Forbidden:
+            # Пользователь заблокировал бота или удалил чат
+            logger.info("Чат %s недоступен, подписки сняты", chat_id)
+            messages.clear()
+            if self.on_blocked:
+                self.on_blocked(chat_id)
+        except BadRequest as e:
+            logger.warning("Сообщение в чат %s отклонено: %s", chat_id, e)
+        except NetworkError as e:
+            if attempt + 1 < MAX_ATTEMPTS:
+                messages.appendleft((text, attempt + 1))
+                return max(self.chat_interval, 2 ** attempt)
+            logger.warning("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+        except TelegramError as e:
+            logger.warning("Не удалось отправить сообщение в чат %s: %s", chat_id, e)
+        return self.chat_interval
+
+def match_subscribers(events, store):
+    """chat_id -> события, подходящие под его подписки (каждое событие один раз)"""
+    keywords = store.values(KIND_KEYWORD)
+    by_chat = defaultdict(dict)
+    for event in events:
+        chats = set(store.subscribers(KIND_TYPE, (event['detected_type'] or "").lower()))
+        text = f"{event['title'] or ''} {event['description'] or ''}".lower()
+        for keyword in keywords:
+            if keyword in text:
+                chats.update(store.subscribers(KIND_KEYWORD, keyword))
+        for chat_id in chats:
+            by_chat[chat_id][event['id']] = event
+    return {chat_id: list(events.values()) for chat_id, events in by_chat.items()}
+
+class Notifier:
+    """После обновления данных рассылает подписчикам события, вставленные с прошлой рассылки"""
+
+    def __init__(self, bot, store=None):
+        self.store = store or SubscriptionStore()
+        self.broadcast = BroadcastQueue(bot, on_blocked=lambda chat_id: self.store.remove(chat_id))
+        self._lock = asyncio.Lock()
+
+    def start(self):
+        if self.store.get_state(WATERMARK_KEY) is None:
+            # Первый запуск: рассылаем только то, что появится дальше, а не всю базу
+            self.store.set_state(WATERMARK_KEY, get_max_event_id())
+        self.broadcast.start()
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    async def on_refresh(self, source, result):
+        """Колбэк RefreshManager: result — итог [RESULT] запуска парсера"""
+        if result and result.get("inserted"):
+            await self.notify_new_events()
+
+    async def notify_new_events(self):
+        async with self._lock:
+            watermark = self.store.get_state(WATERMARK_KEY) or 0
+            up_to = get_max_event_id()
+            while watermark < up_to:
+                events = get_events_between(watermark, up_to, NEW_EVENTS_BATCH)
+                if not events:
+                    break
+                for chat_id, chat_events in match_subscribers(events, self.store).items():
+                    for text in format_notification(chat_events):
+                        self.broadcast.put(chat_id, text)
+                watermark = events[-1]['id']
+                self.store.set_state(WATERMARK_KEY, watermark)
+            self.store.set_state(WATERMARK_KEY, up_to)
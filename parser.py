@@ -1,13 +1,30 @@
 # main.py
 import requests
-from bs4 import BeautifulSoup
-import pandas as pd
+from bs4 import BeautifulSoup, Tag
+import soupsieve
 import urllib3
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import sqlite3
 import json
+import csv
+import asyncio
+import argparse
+import os
+import re
+import time
+import functools
+import threading
+from collections import defaultdict
+from datetime import date as date_cls, datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from http_cache import HttpCache, DetailCache
+from classifier import KeywordClassifier
+import dedup
+from metrics import CrawlMetrics, METRICS_REPORT, METRICS_PROM
+from formatters import render_event_fragment
+from snapshots import SnapshotWriter, rollback
 
 # --- Настройки ---
 OUTPUT_CSV = "osu_events.csv"
@@ -30,6 +47,25 @@ EXCLUDE_PHRASES = [
     "призёр"
 ]
 
+classifier = KeywordClassifier(KEYWORDS, EXCLUDE_PHRASES)
+
+# --- Параллельный обход ---
+MAX_CONCURRENCY = 8       # одновременных запросов всего
+PER_HOST_CONCURRENCY = 2  # одновременных запросов к одному хосту
+HOST_DELAY = 0.5          # минимальная пауза между запросами к одному хосту, сек
+MAX_PAGES = 5             # страниц пагинации ленты за обычный прогон
+BACKFILL_MAX_PAGES = 50   # страниц пагинации при --backfill
+DETAIL_CONCURRENCY = 4    # одновременных загрузок страниц событий при --enrich
+PIPELINE_QUEUE_SIZE = 16  # разобранных страниц в очереди перед записью; обход ждёт, пока запись не догонит
+WRITE_BATCH_SIZE = 200    # событий в одной транзакции записи в базу
+
+# --- Разбор HTML ---
+# html.parser | lxml | auto (самый быстрый доступный). lxml быстрее, но на битой разметке
+# может вернуть другие события, поэтому включается только явно
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "html.parser")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))     # 0 — разбирать в основном процессе
+ENRICH_DETAILS = os.getenv("ENRICH_DETAILS", "0") == "1"  # догружать дату и описание со страниц новых событий
+
 # --- HTTP сессия ---
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 session = requests.Session()
@@ -39,7 +75,7 @@ retries = Retry(
     status_forcelist=(500, 502, 503, 504),
     allowed_methods=frozenset(['GET', 'POST'])
 )
-adapter = HTTPAdapter(max_retries=retries)
+adapter = HTTPAdapter(max_retries=retries, pool_maxsize=MAX_CONCURRENCY)
 session.mount('https://', adapter)
 session.mount('http://', adapter)
 
@@ -48,8 +84,64 @@ HEADERS = {
                   "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 }
 
+# Кэши открываются при первом обращении: импорт parser (бенчмарк, --rollback, процессы пула)
+# не создаёт и не трогает http_cache.db. Бенчмарк подставляет свой HttpCache в parser.http_cache
+http_cache = None
+detail_cache = None
+_caches_lock = threading.Lock()
+
+def get_http_cache():
+    global http_cache
+    with _caches_lock:
+        if http_cache is None:
+            http_cache = HttpCache()
+        return http_cache
+
+def get_detail_cache():
+    global detail_cache
+    with _caches_lock:
+        if detail_cache is None:
+            detail_cache = DetailCache()
+        return detail_cache
+
 # --- Работа с HTTP ---
+def fetch_page(url, force=False, stats=None):
+    """
+    Условный GET через кэш, возвращает (html, changed); changed=False — страница не менялась.
+    В stats (если передан) записываются статус, размер и тайминги запроса
+    """
+    cache = get_http_cache()
+    headers = dict(HEADERS)
+    if not force:
+        headers.update(cache.conditional_headers(url))
+    try:
+        started = time.perf_counter()
+        resp = session.get(url, headers=headers, verify=False, timeout=12)
+        if stats is not None:
+            # elapsed — до заголовков ответа (DNS, соединение, TLS, ожидание сервера), остальное — загрузка тела
+            stats["status"] = resp.status_code
+            stats["bytes"] = len(resp.content)
+            stats["fetch_ms"] = (time.perf_counter() - started) * 1000
+            stats["ttfb_ms"] = min(resp.elapsed.total_seconds() * 1000, stats["fetch_ms"])
+            stats["download_ms"] = stats["fetch_ms"] - stats["ttfb_ms"]
+        if resp.status_code == 304:
+            entry = cache.get(url)
+            if entry:
+                cache.touch(url)
+                return entry["body"], False
+            # В кэше пусто, хотя сервер ответил 304: перезапрашиваем без условий
+            return fetch_page(url, force=True, stats=stats)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print(f"[ERROR] Не удалось загрузить {url}: {e}")
+        return None, False
+
+    # Валидаторы попадут в кэш только после записи прогона (main), иначе упавший прогон потерял бы страницу
+    changed = cache.stage(url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), resp.text)
+    return resp.text, changed or force
+
 def fetch(url):
+    """Обычный GET мимо HTTP-кэша: для разовых загрузок, которые не должны влиять на обход"""
     try:
         resp = session.get(url, headers=HEADERS, verify=False, timeout=12)
         resp.raise_for_status()
@@ -58,45 +150,317 @@ def fetch(url):
         print(f"[ERROR] Не удалось загрузить {url}: {e}")
         return None
 
+# --- Асинхронный обход источников ---
+class HostLimiter:
+    """Ограничивает число одновременных запросов к хосту и выдерживает паузу между ними"""
+
+    def __init__(self, concurrency=PER_HOST_CONCURRENCY, delay=HOST_DELAY):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.delay = delay
+        self._lock = asyncio.Lock()
+        self._next_at = 0.0
+
+    async def wait_turn(self):
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            if self._next_at > now:
+                await asyncio.sleep(self._next_at - now)
+                now = self._next_at
+            self._next_at = now + self.delay
+
+async def run_limited(url, global_sem, limiters, func, *args):
+    """Выполняет запрос func(*args) к хосту url в пуле потоков с учётом общих и per-host лимитов"""
+    host = urlparse(url).netloc
+    limiter = limiters.setdefault(host, HostLimiter())
+    async with limiter.semaphore:
+        await limiter.wait_turn()
+        async with global_sem:
+            return await asyncio.to_thread(func, *args)
+
+async def fetch_async(url, global_sem, limiters, force=False, stats=None):
+    # Ретраи и таймауты те же, что у fetch(): запрос идёт через общую session в пуле потоков
+    return await run_limited(url, global_sem, limiters, fetch_page, url, force, stats)
+
+class CrawlProgress:
+    """Счётчики обхода; строки [PROGRESS] читает RefreshManager из parser_utils"""
+
+    def __init__(self, jobs_per_source):
+        self.remaining = list(jobs_per_source)
+        self.sources_done = sum(1 for n in self.remaining if n == 0)
+        self.events_found = 0
+
+    def job_done(self, source_idx, events_found):
+        self.events_found += events_found
+        self.remaining[source_idx] -= 1
+        if self.remaining[source_idx] == 0:
+            self.sources_done += 1
+        print(f"[PROGRESS] sources={self.sources_done}/{len(self.remaining)} events={self.events_found}", flush=True)
+
+class Frontier:
+    """
+    Настройки обхода ленты вглубь: сколько страниц пагинации проходить и когда останавливаться.
+    В обычном прогоне обход источника прекращается на первой странице без новых релевантных ссылок
+    """
+
+    def __init__(self, known_links, max_pages=MAX_PAGES, stop_on_known=True):
+        self.known_links = known_links
+        self.max_pages = max_pages
+        self.stop_on_known = stop_on_known
+
+    def has_new(self, events):
+        return any(e["link"] not in self.known_links and is_relevant(e) for e in events)
+
+def timed_parse(parse, html, url):
+    """parse с замером времени; время считается там, где идёт разбор, в том числе в процессе пула"""
+    started = time.perf_counter()
+    events, next_url = parse(html, url)
+    return events, next_url, (time.perf_counter() - started) * 1000
+
+async def process_page(parse, url, global_sem, limiters, force, pool, record):
+    html, changed = await fetch_async(url, global_sem, limiters, force, record)
+    record["changed"] = changed
+    if not html or not changed:
+        return html, changed, [], None
+    if pool:
+        # Разбор уходит в отдельный процесс, пока остальные страницы ещё качаются
+        events, next_url, parse_ms = await asyncio.get_running_loop().run_in_executor(pool, timed_parse, parse, html, url)
+    else:
+        events, next_url, parse_ms = timed_parse(parse, html, url)
+    record["parse_ms"] = parse_ms
+    record["candidates"] = len(events)
+    return html, changed, events, next_url
+
+async def process_job(job, global_sem, limiters, force, pool, progress, frontier, queue, metrics):
+    """Проходит страницы одной ленты по ссылкам пагинации и кладёт (url, ok, changed, events, record) в очередь"""
+    source_idx, parse, url = job
+    pages = 0
+    events_found = 0
+    visited = set()
+    while url and url not in visited and pages < frontier.max_pages:
+        visited.add(url)
+        record = metrics.page(source_idx, url)
+        html, changed, events, next_url = await process_page(parse, url, global_sem, limiters, force, pool, record)
+        pages += 1
+        events_found += len(events)
+        # Сам HTML дальше не нужен: в очередь уходит только признак успешной загрузки
+        await queue.put((url, bool(html), changed, events, record))
+        if not html or not changed:
+            break
+        if frontier.stop_on_known and not frontier.has_new(events):
+            break
+        url = next_url
+    progress.job_done(source_idx, events_found)
+
+def load_known_links():
+    try:
+        # Только чтение: без опубликованной базы не создаём пустой файл, который publish() сохранил бы как снимок
+        conn = sqlite3.connect(f"file:{DB_NAME}?mode=ro", uri=True)
+        try:
+            return {row[0] for row in conn.execute(f"SELECT link FROM {TABLE_NAME}")}
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return set()
+
+async def crawl(sources, force=False, pool=None, frontier=None, metrics=None, global_sem=None, limiters=None):
+    """
+    Загружает и разбирает страницы источников параллельно и отдаёт (url, ok, changed, events, record)
+    по мере готовности; record — запись CrawlMetrics о странице.
+    Очередь ограничена, поэтому в памяти не больше PIPELINE_QUEUE_SIZE страниц
+    """
+    # Лимиты можно передать снаружи, чтобы с ними считались и другие стадии (DetailEnricher)
+    global_sem = global_sem or asyncio.Semaphore(MAX_CONCURRENCY)
+    limiters = {} if limiters is None else limiters
+    frontier = frontier or Frontier(load_known_links())
+    metrics = metrics or CrawlMetrics(sources)
+    jobs = []
+
+    for i, src in enumerate(sources):
+        print(f"[*] Парсим университет: {src['name']}")
+        news_url = src.get("news_url")
+        if news_url:
+            jobs.append((i, news_parser(src), news_url))
+        for doc_url in src.get("doc_urls", []):
+            jobs.append((i, parse_docs_page, doc_url))
+
+    progress = CrawlProgress([sum(1 for job in jobs if job[0] == i) for i in range(len(sources))])
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    async def produce():
+        try:
+            await asyncio.gather(*(
+                process_job(job, global_sem, limiters, force, pool, progress, frontier, queue, metrics) for job in jobs
+            ))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (page := await queue.get()) is not None:
+            yield page
+        await producer
+    finally:
+        producer.cancel()
+
+# --- HTML-бэкенд ---
+def available_backends():
+    backends = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        backends.insert(0, "lxml")
+    except ImportError:
+        pass
+    return backends
+
+def set_backend(name):
+    global PARSER_BACKEND
+    if name != "auto" and name not in available_backends():
+        raise ValueError(f"HTML-бэкенд недоступен: {name}")
+    PARSER_BACKEND = name
+    # Процессы пула при spawn заново импортируют модуль и читают бэкенд из окружения
+    os.environ["PARSER_BACKEND"] = name
+
+def make_soup(html, backend=None):
+    backend = backend or PARSER_BACKEND
+    if backend == "auto":
+        backend = available_backends()[0]
+    return BeautifulSoup(html, backend)
+
+def compare_backends(pages):
+    """Разбирает страницы всеми доступными бэкендами и сравнивает время и результат"""
+    for parse, url, html in pages:
+        results = {}
+        for backend in available_backends():
+            started = time.perf_counter()
+            events = parse(html, url, backend=backend)
+            results[backend] = (events, time.perf_counter() - started)
+        reference = results["html.parser"][0]
+        for backend, (events, elapsed) in results.items():
+            status = "OK" if events == reference else "РАСХОЖДЕНИЕ"
+            print(f"[*] {url} | {backend}: {elapsed * 1000:.1f} мс, событий: {len(events)}, {status}")
+
 def extract_text_or_none(el):
     return el.get_text(strip=True) if el else ""
 
 # --- Парсинг новостей и документов ---
-def parse_news_list(html, base_url):
-    soup = BeautifulSoup(html, "html.parser")
+NEWS_SELECTORS = [
+    "article", ".news-item", ".news-list .item", ".news", ".item", ".post", ".newsRow"
+]
+TITLE_TAGS = ("h1", "h2", "h3", "h4", "a")
+DATE_CLASSES = ("date", "news-date", "item-date", "entry-date")
+DESC_CLASSES = ("description", "intro", "lead", "anons", "text")
+
+def match_selectors(el, classes, in_news_list):
+    """Номера селекторов из NEWS_SELECTORS, которым соответствует элемент"""
+    matched = []
+    if el.name == "article":
+        matched.append(0)
+    if "news-item" in classes:
+        matched.append(1)
+    if "item" in classes and in_news_list:
+        matched.append(2)
+    if "news" in classes:
+        matched.append(3)
+    if "item" in classes:
+        matched.append(4)
+    if "post" in classes:
+        matched.append(5)
+    if "newsRow" in classes:
+        matched.append(6)
+    return matched
+
+def element_features(el, classes):
+    """Признаки элемента, по которым ищутся заголовок, ссылка, дата и описание"""
+    features = []
+    if el.name in TITLE_TAGS:
+        features.append(el.name)
+        if el.name == "a" and el.has_attr("href"):
+            features.append("a[href]")
+    elif el.name in ("time", "p"):
+        features.append(el.name)
+    for cls in DATE_CLASSES:
+        if any(cls in c for c in classes):
+            features.append("date:" + cls)
+    for cls in DESC_CLASSES:
+        if any(cls in c for c in classes):
+            features.append("desc:" + cls)
+    return features
+
+def scan_news_tree(soup):
+    """
+    Один обход дерева: раскладывает кандидатов по селекторам и для каждого элемента
+    запоминает первого потомка с каждым признаком (аналог node.find(...) без повторных проходов)
+    """
+    buckets = [[] for _ in NEWS_SELECTORS]
+    first_found = {}
+    features = {}
+    news_list_depth = 0
+    stack = [(soup, False)]
+
+    while stack:
+        el, leaving = stack.pop()
+        if not leaving:
+            classes = el.get("class") or []
+            if el is not soup:
+                for i in match_selectors(el, classes, news_list_depth > 0):
+                    buckets[i].append(el)
+                features[id(el)] = element_features(el, classes)
+            if "news-list" in classes:
+                news_list_depth += 1
+            stack.append((el, True))
+            children = [c for c in el.children if isinstance(c, Tag)]
+            stack.extend((c, False) for c in reversed(children))
+            continue
+
+        if "news-list" in (el.get("class") or []):
+            news_list_depth -= 1
+        found = {}
+        for child in el.children:
+            if not isinstance(child, Tag):
+                continue
+            for f in features[id(child)]:
+                found.setdefault(f, child)
+            for f, node in first_found[id(child)].items():
+                found.setdefault(f, node)
+        first_found[id(el)] = found
+
     candidates = []
+    seen_nodes = set()
+    for bucket in buckets:
+        for node in bucket:
+            if id(node) not in seen_nodes:
+                seen_nodes.add(id(node))
+                candidates.append(node)
+    return candidates, first_found
+
+def parse_news_list(html, base_url, backend=None):
+    return extract_news(make_soup(html, backend), base_url)
 
-    selectors = [
-        "article", ".news-item", ".news-list .item", ".news", ".item", ".post", ".newsRow"
-    ]
-    for sel in selectors:
-        found = soup.select(sel)
-        if found:
-            candidates.extend(found)
+def extract_news(soup, base_url):
+    candidates, first_found = scan_news_tree(soup)
 
     if not candidates:
         main = soup.find('main') or soup.find('div', id='content') or soup
-        links = main.find_all('a', href=True)
-        for a in links:
-            candidates.append(a)
+        candidates = main.find_all('a', href=True)
 
     events = []
     seen_links = set()
 
     for node in candidates:
+        found = first_found[id(node)]
         title = ""
         link = ""
         date = ""
         description = ""
 
         a = None
-        for tag in ("h1","h2","h3","h4","a"):
-            a = node.find(tag) if hasattr(node, "find") else None
+        for tag in TITLE_TAGS:
+            a = found.get(tag)
             if a and a.name == "a" or (a and a.get_text(strip=True)):
                 break
             a = None
 
-        if not a and getattr(node, "name", "") == "a":
+        if not a and node.name == "a":
             a = node
 
         if a:
@@ -104,32 +468,30 @@ def parse_news_list(html, base_url):
             raw_href = a.get("href", "")
             link = urljoin(base_url, raw_href)
         else:
-            a2 = node.find('a', href=True) if hasattr(node, "find") else None
+            a2 = found.get("a[href]")
             if a2:
                 title = extract_text_or_none(a2)
                 link = urljoin(base_url, a2.get('href', ''))
 
-        time_tag = node.find('time') if hasattr(node, "find") else None
+        time_tag = found.get("time")
         if time_tag:
             date = extract_text_or_none(time_tag)
         else:
-            for cls in ("date","news-date","item-date","entry-date"):
-                date_el = node.find(attrs={"class": lambda x: x and cls in x}) if hasattr(node, "find") else None
+            for cls in DATE_CLASSES:
+                date_el = found.get("date:" + cls)
                 if date_el:
                     date = extract_text_or_none(date_el)
                     break
 
-        desc = None
-        for cls in ("description","intro","lead","anons","text"):
-            desc = node.find(attrs={"class": lambda x: x and cls in x}) if hasattr(node, "find") else None
+        for cls in DESC_CLASSES:
+            desc = found.get("desc:" + cls)
             if desc:
                 description = extract_text_or_none(desc)
                 break
         if not description:
-            p = node.find('p') if hasattr(node, "find") else None
-            description = extract_text_or_none(p)
+            description = extract_text_or_none(found.get("p"))
 
-        if not title and hasattr(node, "get_text"):
+        if not title:
             title = extract_text_or_none(node)
 
         if link in seen_links or (not title and not link):
@@ -145,15 +507,15 @@ def parse_news_list(html, base_url):
 
     return events
 
-def parse_docs(html, base_url):
-    soup = BeautifulSoup(html, "html.parser")
+def parse_docs(html, base_url, backend=None):
+    soup = make_soup(html, backend)
     events = []
 
     links = soup.find_all('a', href=True)
     for a in links:
         title = extract_text_or_none(a)
         link = urljoin(base_url, a['href'])
-        if any(kw.lower() in title.lower() for kw in KEYWORDS):
+        if classifier.has_keyword(title):
             events.append({
                 "title": title,
                 "date": "",
@@ -162,61 +524,713 @@ def parse_docs(html, base_url):
             })
     return events
 
+# --- Пагинация ---
+NEXT_PAGE_TEXTS = ("следующая", "следующая страница", "далее", "вперед", "вперёд", "next", "»", "›", "→")
+PAGINATION_SELECTORS = ".pagination, .pager, .paging, .pages, .nav-links, .page-navigation, .modern-page-navigation"
+
+def find_next_page(soup, base_url):
+    """Ссылка на следующую страницу ленты: rel=next или «Следующая»/» внутри блока пагинации"""
+    el = soup.find(["a", "link"], rel="next", href=True)
+    if el:
+        return urljoin(base_url, el["href"])
+    for container in soup.select(PAGINATION_SELECTORS):
+        for a in container.find_all("a", href=True):
+            if a.get_text(strip=True).lower() in NEXT_PAGE_TEXTS or "next" in (a.get("class") or []):
+                return urljoin(base_url, a["href"])
+    return None
+
+def parse_news_page(html, base_url, backend=None):
+    """События страницы ленты и адрес следующей страницы (None, если её нет)"""
+    soup = make_soup(html, backend)
+    return extract_news(soup, base_url), find_next_page(soup, base_url)
+
+def parse_docs_page(html, base_url, backend=None):
+    return parse_docs(html, base_url, backend), None
+
+# --- Профили источников ---
+PROFILE_SELECTORS = ("item", "title", "link", "date", "description", "next")
+
+class NewsProfile:
+    """
+    Разбор ленты по селекторам из поля "profile" источника в sources.json:
+    item — блок новости; title, link, date, description — селекторы внутри блока;
+    date_format — формат strptime для даты; next — ссылка на следующую страницу.
+    Обязателен только item; заголовок и ссылка по умолчанию — первая a[href] блока
+    """
+
+    def __init__(self, profile):
+        if not isinstance(profile, dict):
+            raise ValueError("профиль должен быть JSON-объектом")
+        unknown = set(profile) - set(PROFILE_SELECTORS) - {"date_format"}
+        if unknown:
+            raise ValueError(f"неизвестные поля профиля: {', '.join(sorted(unknown))}")
+        if not profile.get("item"):
+            raise ValueError("в профиле нет селектора item")
+        self.selectors = {name: soupsieve.compile(profile[name]) for name in PROFILE_SELECTORS if profile.get(name)}
+        self.date_format = profile.get("date_format")
+
+    def select_one(self, name, el):
+        selector = self.selectors.get(name)
+        return selector.select_one(el) if selector else None
+
+    def items(self, soup):
+        return self.selectors["item"].select(soup)
+
+    def extract(self, items, base_url):
+        events = []
+        seen_links = set()
+        for item in items:
+            title_el = self.select_one("title", item) or item.find("a", href=True)
+            link_el = self.select_one("link", item) or title_el
+            if link_el is not None and not link_el.has_attr("href"):
+                link_el = link_el.find("a", href=True)
+
+            title = extract_text_or_none(title_el)
+            link = urljoin(base_url, link_el["href"]) if link_el is not None else ""
+            if link in seen_links or (not title and not link):
+                continue
+            seen_links.add(link)
+
+            event = {
+                "title": title,
+                "date": extract_text_or_none(self.select_one("date", item)),
+                "link": link,
+                "description": extract_text_or_none(self.select_one("description", item))
+            }
+            if self.date_format and event["date"]:
+                try:
+                    event["date_iso"] = datetime.strptime(event["date"], self.date_format).date().isoformat()
+                except ValueError:
+                    pass
+            events.append(event)
+        return events
+
+    def next_page(self, soup, base_url):
+        if "next" not in self.selectors:
+            return find_next_page(soup, base_url)
+        el = self.select_one("next", soup)
+        return urljoin(base_url, el["href"]) if el is not None and el.has_attr("href") else None
+
+@functools.lru_cache(maxsize=None)
+def news_profile(profile_key):
+    """Скомпилированный профиль; ключ — JSON профиля, чтобы кэш работал и в процессах пула"""
+    return NewsProfile(json.loads(profile_key))
+
+def profile_key(profile):
+    return json.dumps(profile, sort_keys=True, ensure_ascii=False)
+
+def parse_profile_page(html, base_url, backend=None, profile=None):
+    """Как parse_news_page, но по профилю источника; если блоки не нашлись — общая эвристика"""
+    soup = make_soup(html, backend)
+    extractor = news_profile(profile_key(profile))
+    items = extractor.items(soup)
+    events = extractor.extract(items, base_url) if items else extract_news(soup, base_url)
+    return events, extractor.next_page(soup, base_url)
+
+def news_parser(src):
+    """Функция разбора ленты источника: по профилю, если он задан и корректен"""
+    profile = src.get("profile")
+    if not profile:
+        return parse_news_page
+    try:
+        news_profile(profile_key(profile))
+    except (ValueError, TypeError, soupsieve.SelectorSyntaxError) as e:
+        print(f"[ERROR] Профиль источника {src['name']} не применён: {e}")
+        return parse_news_page
+    # partial с модульной функцией и словарём сериализуется для ProcessPoolExecutor
+    return functools.partial(parse_profile_page, profile=profile)
+
+# --- Страницы событий ---
+MAX_DESCRIPTION = 1000
+DETAIL_SKIP_EXTENSIONS = (".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".rtf", ".zip", ".rar")
+DETAIL_BODY_CLASSES = re.compile(r"news-detail|detail|article|content")
+
+def fetch_detail(url):
+    """HTML страницы события без записи в HTTP-кэш (страница нужна один раз); "" — не HTML"""
+    try:
+        resp = session.get(url, headers=HEADERS, verify=False, timeout=12)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print(f"[ERROR] Не удалось загрузить страницу события {url}: {e}")
+        return None
+    if "html" not in resp.headers.get("Content-Type", "text/html"):
+        return ""
+    return resp.text
+
+def parse_detail(html, backend=None):
+    """Дата (ISO или None) и текст новости со страницы события"""
+    soup = make_soup(html, backend)
+
+    raw_dates = []
+    time_tag = soup.find("time")
+    if time_tag:
+        raw_dates += [time_tag.get("datetime", ""), extract_text_or_none(time_tag)]
+    meta = soup.find("meta", attrs={"property": "article:published_time"})
+    if meta:
+        raw_dates.append(meta.get("content", ""))
+    for cls in DATE_CLASSES:
+        el = soup.find(class_=re.compile(re.escape(cls)))
+        if el:
+            raw_dates.append(extract_text_or_none(el))
+            break
+    date_iso = next((d for d in map(normalize_date, raw_dates) if d), None)
+
+    body = soup.find("article") or soup.find(class_=DETAIL_BODY_CLASSES) or soup.find("main")
+    description = ""
+    if body:
+        description = " ".join(p.get_text(" ", strip=True) for p in body.find_all("p")).strip()
+    if not description:
+        meta = soup.find("meta", attrs={"property": "og:description"}) or soup.find("meta", attrs={"name": "description"})
+        description = meta.get("content", "").strip() if meta else ""
+    return date_iso, description[:MAX_DESCRIPTION]
+
+class DetailEnricher:
+    """
+    Догружает дату и полное описание со страниц новых событий. Загрузки идут параллельно
+    (не больше DETAIL_CONCURRENCY сразу) с теми же лимитами хостов, что и обход лент;
+    результат хранится в detail_cache по ссылке, поэтому страница загружается один раз.
+    Уже загруженные данные применяются в каждом прогоне; fetch=False (без --enrich) только
+    не загружает новые страницы, иначе прогон вернул бы в базу короткое описание из ленты
+    """
+
+    def __init__(self, known_links, global_sem, limiters, pool=None, fetch=True):
+        self.known_links = known_links
+        self.global_sem = global_sem
+        self.limiters = limiters
+        self.pool = pool
+        self.fetch = fetch
+        self.semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
+
+    async def enrich(self, events):
+        await asyncio.gather(*(self.enrich_event(e) for e in events))
+
+    async def enrich_event(self, event):
+        link = event["link"]
+        if urlparse(link).path.lower().endswith(DETAIL_SKIP_EXTENSIONS):
+            return
+        details = get_detail_cache().get(link)
+        if details is None:
+            if not self.fetch or link in self.known_links:
+                # Событие уже в базе: его страницу в этот раз не загружаем
+                return
+            async with self.semaphore:
+                html = await run_limited(link, self.global_sem, self.limiters, fetch_detail, link)
+            if html is None:
+                return
+            date_iso, description = None, ""
+            if html:
+                if self.pool:
+                    date_iso, description = await asyncio.get_running_loop().run_in_executor(self.pool, parse_detail, html)
+                else:
+                    date_iso, description = parse_detail(html)
+            details = {"date_iso": date_iso, "description": description}
+            get_detail_cache().put(link, date_iso, description)
+        apply_details(event, details)
+
+def apply_details(event, details):
+    if details["date_iso"] and not event.get("date_iso") and not normalize_date(event["date"]):
+        year, month, day = details["date_iso"].split("-")
+        event["date"] = f"{day}.{month}.{year}"
+        event["date_iso"] = details["date_iso"]
+    if details["description"] and len(details["description"]) > len(event["description"]):
+        event["description"] = details["description"]
+
 # --- Фильтрация ---
 def is_relevant(event):
-    text = " ".join([event.get("title",""), event.get("description","")]).lower()
-    for phrase in EXCLUDE_PHRASES:
-        if phrase.lower() in text:
-            return False
-    for kw in KEYWORDS:
-        if kw.lower() in text:
-            return True
-    return False
+    result = classifier.classify_event(event)
+    return bool(result.detected_type) and not result.excluded
 
 def enrich_and_filter(events):
     out = []
-    for e in events:
-        ttype = None
-        text = " ".join([e.get("title",""), e.get("description","")]).lower()
-        for kw in KEYWORDS:
-            if kw.lower() in text:
-                ttype = kw
-                break
-        e["detected_type"] = ttype if ttype else ""
-        if is_relevant(e):
+    for e, result in zip(events, classifier.classify_many(events)):
+        e["detected_type"] = result.detected_type
+        if result.detected_type and not result.excluded:
             out.append(e)
     return out
 
+# --- Даты ---
+MONTHS = {
+    "янв": 1, "фев": 2, "мар": 3, "апр": 4, "мая": 5, "май": 5, "июн": 6,
+    "июл": 7, "авг": 8, "сен": 9, "окт": 10, "ноя": 11, "дек": 12
+}
+NUMERIC_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4}|\d{2})\b")
+ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+TEXT_DATE_RE = re.compile(r"(\d{1,2})\s+([а-яё]{3,})\.?(?:\s+(\d{4}))?")
+
+def normalize_date(raw, today=None, relative=True):
+    """
+    Приводит дату со страницы к ISO (YYYY-MM-DD) для сортировки и индексов.
+    Понимает "22.10.2025", "2025-10-22", "22 октября 2025", "4 фев в 08:15", "сегодня"/"вчера";
+    для остального возвращает None. Даты без года и "сегодня"/"вчера" отсчитываются от today —
+    это верно только в момент обхода; relative=False для них возвращает None
+    """
+    if not raw:
+        return None
+    text = raw.lower()
+    today = today or date_cls.today()
+    try:
+        if not relative and ("сегодня" in text or "вчера" in text):
+            return None
+        if "сегодня" in text:
+            return today.isoformat()
+        if "вчера" in text:
+            return (today - timedelta(days=1)).isoformat()
+        m = NUMERIC_DATE_RE.search(text)
+        if m:
+            day, month, year = int(m.group(1)), int(m.group(2)), int(m.group(3))
+            if year < 100:
+                year += 2000
+            return date_cls(year, month, day).isoformat()
+        m = ISO_DATE_RE.search(text)
+        if m:
+            return date_cls(int(m.group(1)), int(m.group(2)), int(m.group(3))).isoformat()
+        m = TEXT_DATE_RE.search(text)
+        if m and m.group(2)[:3] in MONTHS:
+            day, month = int(m.group(1)), MONTHS[m.group(2)[:3]]
+            if m.group(3):
+                return date_cls(int(m.group(3)), month, day).isoformat()
+            if not relative:
+                return None
+            # Год не указан: ближайшая прошедшая дата (лента новостей не смотрит в будущее дальше месяца)
+            parsed = date_cls(today.year, month, day)
+            if parsed > today + timedelta(days=31):
+                parsed = parsed.replace(year=today.year - 1)
+            return parsed.isoformat()
+    except ValueError:
+        pass
+    return None
+
 # --- SQLite ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(f"""
+EVENT_COLUMNS = ("title", "date", "link", "description", "detected_type")
+# meta.schema_version: init_db приводит базу к этой версии (date_iso, canonical_id, fragment, FTS, индексы)
+SCHEMA_VERSION = 1
+
+def connect_db(path=None):
+    conn = sqlite3.connect(path or DB_NAME)
+    # WAL: пачки одного прогона коммитятся быстро; NORMAL достаточно для WAL и не делает fsync на каждый коммит.
+    # Бот эту базу не видит до публикации снимка (snapshots.SnapshotWriter)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def init_db(conn):
+    conn.execute(f"""
         CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT,
             date TEXT,
             link TEXT UNIQUE,
             description TEXT,
-            detected_type TEXT
+            detected_type TEXT,
+            date_iso TEXT,
+            canonical_id INTEGER,
+            fragment TEXT
         )
     """)
-    conn.commit()
-    conn.close()
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+    migrate_date_iso(conn)
+    migrate_dedup(conn)
+    migrate_fragments(conn)
+    init_indexes(conn)
+    init_fts(conn)
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES ('schema_version', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (SCHEMA_VERSION,))
 
-def save_events_to_db(events):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    for e in events:
+def read_schema_version(path):
+    """Версия схемы базы path: None — базы нет, 0 — база без миграций (нет meta)"""
+    if not os.path.exists(path):
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return int(row[0]) if row else 0
+
+def bump_generation(conn):
+    # Новое поколение данных: бот сбрасывает кэш ответов (database.get_generation)
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES ('generation', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """)
+
+def upgrade_db(snapshot=None):
+    """
+    Приводит опубликованную базу к текущей схеме и публикует результат.
+    Запросы бота читают date_iso, canonical_id и FTS-индекс, поэтому миграция идёт при старте
+    парсера и бота (parser_worker), а не при первой записи событий. Возвращает True, если база обновлена
+    """
+    version = read_schema_version(DB_NAME)
+    if version is not None and version >= SCHEMA_VERSION:
+        return False
+    snapshot = snapshot or SnapshotWriter(DB_NAME)
+    try:
+        conn = connect_db(snapshot.open())
         try:
-            cursor.execute(f"""
-                INSERT OR IGNORE INTO {TABLE_NAME} (title, date, link, description, detected_type)
-                VALUES (?, ?, ?, ?, ?)
-            """, (e['title'], e['date'], e['link'], e['description'], e['detected_type']))
-        except sqlite3.Error as ex:
-            print(f"[ERROR] Не удалось сохранить событие {e['title']}: {ex}")
-    conn.commit()
-    conn.close()
+            with conn:
+                init_db(conn)
+                bump_generation(conn)
+        finally:
+            conn.close()
+        snapshot.publish()
+    finally:
+        snapshot.close()
+    print(f"[*] Схема базы {DB_NAME} обновлена до версии {SCHEMA_VERSION}")
+    return True
+
+def migrate_date_iso(conn):
+    """Колонка date_iso и индексы для выборок по типу/дате и статистики"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+    if "date_iso" not in columns:
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN date_iso TEXT")
+        # День обхода старых строк неизвестен: относительные даты и даты без года оставляем пустыми
+        conn.create_function("normalize_date", 1, lambda raw: normalize_date(raw, relative=False), deterministic=True)
+        # Пустая строка вместо NULL: keyset-курсор (date_iso, id) сравнивается без особых случаев.
+        # Новые строки save_events_to_db всегда пишет с date_iso, поэтому заполняем только здесь
+        conn.execute(f"UPDATE {TABLE_NAME} SET date_iso = COALESCE(normalize_date(date), '')")
+
+def migrate_dedup(conn):
+    """canonical_id и таблицы MinHash-подписей/LSH-корзин для склейки почти одинаковых событий"""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+    if "canonical_id" not in columns:
+        conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN canonical_id INTEGER")
+    conn.execute("CREATE TABLE IF NOT EXISTS event_signatures (event_id INTEGER PRIMARY KEY, minhash BLOB)")
+    conn.execute("CREATE TABLE IF NOT EXISTS event_lsh (band INTEGER, bucket INTEGER, event_id INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_event_lsh_bucket ON event_lsh (band, bucket)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_event_lsh_event ON event_lsh (event_id)")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'minhash_version'").fetchone()
+    if (row[0] if row else 1) != dedup.MINHASH_VERSION:
+        # Подписи другой версии несравнимы с новыми: пересчитываем их и корзины, canonical_id не трогаем
+        signature_rows, lsh_rows = [], []
+        for event_id, title, description in conn.execute(
+            f"SELECT e.id, e.title, e.description FROM {TABLE_NAME} AS e JOIN event_signatures AS s ON s.event_id = e.id"
+        ).fetchall():
+            signature = dedup.minhash(dedup.event_text(title, description))
+            if signature is None:
+                continue
+            signature_rows.append((event_id, dedup.to_blob(signature)))
+            lsh_rows += [(band, bucket, event_id) for band, bucket in enumerate(dedup.band_buckets(signature))]
+        conn.execute("DELETE FROM event_lsh")
+        conn.executemany("UPDATE event_signatures SET minhash = ? WHERE event_id = ?",
+                         [(blob, event_id) for event_id, blob in signature_rows])
+        conn.executemany("INSERT INTO event_lsh (band, bucket, event_id) VALUES (?, ?, ?)", lsh_rows)
+        conn.execute("""
+            INSERT INTO meta (key, value) VALUES ('minhash_version', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (dedup.MINHASH_VERSION,))
+
+def migrate_fragments(conn):
+    """
+    Колонка fragment с готовым HTML-блоком события для бота. Старые строки заполняются один раз,
+    когда колонка добавлена: save_events_to_db пишет fragment вместе с событием
+    """
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+    if "fragment" in columns:
+        return
+    conn.execute(f"ALTER TABLE {TABLE_NAME} ADD COLUMN fragment TEXT")
+    rows = conn.execute(f"SELECT id, title, date, link, detected_type FROM {TABLE_NAME}").fetchall()
+    conn.executemany(
+        f"UPDATE {TABLE_NAME} SET fragment = ? WHERE id = ?",
+        [(render_event_fragment(dict(zip(("title", "date", "link", "detected_type"), row[1:]))), row[0])
+         for row in rows]
+    )
+
+# Условие «событие не дубликат»; в database.py запросы используют то же выражение,
+# чтобы планировщик SQLite выбирал частичные индексы ниже
+CANONICAL_WHERE = "(canonical_id IS NULL OR canonical_id = id)"
+
+def init_indexes(conn):
+    # Частичные индексы только по каноническим событиям: (detected_type, date_iso) для
+    # статистики и выборки по типу, (date_iso) для общей ленты
+    conn.execute(f"DROP INDEX IF EXISTS idx_{TABLE_NAME}_type_date")
+    conn.execute(f"DROP INDEX IF EXISTS idx_{TABLE_NAME}_date")
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_canon_type_date
+        ON {TABLE_NAME} (detected_type, date_iso) WHERE {CANONICAL_WHERE}
+    """)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_canon_date
+        ON {TABLE_NAME} (date_iso) WHERE {CANONICAL_WHERE}
+    """)
+
+def init_fts(conn):
+    """Полнотекстовый индекс по title/description, синхронизируется с таблицей триггерами"""
+    fts = f"{TABLE_NAME}_fts"
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            title, description,
+            content='{TABLE_NAME}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_NAME}_fts_ai AFTER INSERT ON {TABLE_NAME} BEGIN
+            INSERT INTO {fts} (rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_NAME}_fts_ad AFTER DELETE ON {TABLE_NAME} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_NAME}_fts_au AFTER UPDATE OF title, description ON {TABLE_NAME} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {fts} (rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """)
+    if not exists:
+        # Индекс появился в уже заполненной базе: строим его по существующим строкам
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+def save_events_to_db(events, path=None, init=True):
+    """
+    Upsert событий одной транзакцией в path (по умолчанию DB_NAME). Новые ссылки вставляются,
+    у известных обновляются изменившиеся поля. Возвращает счётчики inserted/updated/unchanged,
+    при ошибке записи — None. init=False — схема базы уже проверена (DbWriter делает это один раз на прогон)
+    """
+    # При повторе ссылки в одном прогоне остаётся первое событие, как было с INSERT OR IGNORE
+    rows = {}
+    for e in events:
+        # date_iso уже есть у событий, разобранных профилем с date_format
+        date_iso = e.get("date_iso") or normalize_date(e["date"]) or ""
+        rows.setdefault(e["link"], tuple(e[c] for c in EVENT_COLUMNS) + (date_iso, render_event_fragment(e)))
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    conn = connect_db(path)
+    try:
+        with conn:
+            if init:
+                init_db(conn)
+            count_before = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+            # rowcount, в отличие от total_changes, не учитывает записи триггеров в FTS-индекс
+            changed = conn.executemany(f"""
+                INSERT INTO {TABLE_NAME} (title, date, link, description, detected_type, date_iso, fragment)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(link) DO UPDATE SET
+                    title = excluded.title,
+                    date = excluded.date,
+                    date_iso = excluded.date_iso,
+                    description = excluded.description,
+                    detected_type = excluded.detected_type,
+                    fragment = excluded.fragment,
+                    canonical_id = CASE
+                        WHEN title IS NOT excluded.title OR description IS NOT excluded.description THEN NULL
+                        ELSE canonical_id
+                    END
+                WHERE title IS NOT excluded.title
+                   OR date IS NOT excluded.date
+                   OR description IS NOT excluded.description
+                   OR detected_type IS NOT excluded.detected_type
+                   OR fragment IS NOT excluded.fragment
+            """, rows.values()).rowcount
+            counts["inserted"] = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] - count_before
+            counts["updated"] = changed - counts["inserted"]
+            counts["unchanged"] = len(rows) - changed
+            # Почти дубликаты склеиваются потом одним проходом (cluster_events): MinHash в пачках не считается
+            if changed:
+                bump_generation(conn)
+    except sqlite3.Error as ex:
+        print(f"[ERROR] Не удалось сохранить события: {ex}")
+        return None
+    finally:
+        conn.close()
+    return counts
+
+# Последние события из каждой корзины подписи — один запрос на событие вместо запроса на полосу
+LSH_CANDIDATES_SQL = " UNION ".join(
+    "SELECT * FROM (SELECT event_id FROM event_lsh WHERE band = ? AND bucket = ? ORDER BY rowid DESC LIMIT ?)"
+    for _ in range(dedup.BANDS)
+)
+
+def first_similar(signature, candidates):
+    """canonical_id самого нового из (id, подпись BLOB, canonical_id), похожего на signature, или None"""
+    for _, blob, canonical_id in sorted(candidates, reverse=True):
+        # Подпись разворачивается из BLOB только при сравнении: обычно хватает первой
+        if dedup.similarity(signature, dedup.from_blob(blob)) >= dedup.SIMILARITY_THRESHOLD:
+            return canonical_id
+    return None
+
+def cluster_events(path=None):
+    """
+    Склейка почти дубликатов отдельным проходом по новым и изменённым событиям (canonical_id IS NULL).
+    MinHash — самая дорогая часть обработки события, поэтому пачки записи его не считают:
+    проход запускается один раз после всех пачек прогона, до публикации снимка. False — ошибка базы
+    """
+    conn = connect_db(path)
+    try:
+        with conn:
+            assign_canonical_ids(conn)
+    except sqlite3.Error as ex:
+        print(f"[ERROR] Не удалось склеить почти дубликаты: {ex}")
+        return False
+    finally:
+        conn.close()
+    return True
+
+def assign_canonical_ids(conn):
+    """
+    Новым и изменённым событиям (canonical_id IS NULL) ищет почти дубликат через LSH-корзины
+    и записывает его canonical_id; без пары событие само становится каноническим.
+    Из каждой корзины берётся не больше dedup.BUCKET_CANDIDATES последних событий, подписи кандидатов
+    читаются одним запросом, сравнение идёт от новых к старым до первого похожего.
+    Записи копятся и уходят в базу одним executemany на таблицу
+    """
+    pending = conn.execute(
+        f"SELECT id, title, description FROM {TABLE_NAME} WHERE canonical_id IS NULL ORDER BY id"
+    ).fetchall()
+    if not pending:
+        return
+    conn.executemany("DELETE FROM event_lsh WHERE event_id = ?", [(row[0],) for row in pending])
+
+    # События этой пачки ещё не в event_lsh: корзины, подписи и canonical_id держим в памяти
+    batch_buckets = defaultdict(list)
+    batch = {}
+    updates, signature_rows, lsh_rows, empty = [], [], [], []
+    for event_id, title, description in pending:
+        signature = dedup.minhash(dedup.event_text(title, description))
+        if signature is None:
+            empty.append((event_id,))
+            updates.append((event_id, event_id))
+            continue
+
+        buckets = dedup.band_buckets(signature)
+        # Почти дубликаты одной группы обычно ссылаются на один canonical_id: достаточно первого похожего,
+        # сначала среди событий этой пачки, и только без совпадения — запрос к базе
+        candidates = set()
+        for band, bucket in enumerate(buckets):
+            candidates.update(batch_buckets[band, bucket][-dedup.BUCKET_CANDIDATES:])
+        canonical_id = first_similar(signature, [(c,) + batch[c] for c in candidates])
+        if canonical_id is None:
+            params = [value for band, bucket in enumerate(buckets) for value in (band, bucket, dedup.BUCKET_CANDIDATES)]
+            stored_ids = [row[0] for row in conn.execute(LSH_CANDIDATES_SQL, params)]
+            if stored_ids:
+                canonical_id = first_similar(signature, conn.execute(f"""
+                    SELECT s.event_id, s.minhash, COALESCE(e.canonical_id, e.id)
+                    FROM event_signatures AS s JOIN {TABLE_NAME} AS e ON e.id = s.event_id
+                    WHERE s.event_id IN ({','.join('?' * len(stored_ids))})
+                """, stored_ids).fetchall())
+        if canonical_id is None:
+            canonical_id = event_id
+
+        blob = dedup.to_blob(signature)
+        batch[event_id] = (blob, canonical_id)
+        for band, bucket in enumerate(buckets):
+            batch_buckets[band, bucket].append(event_id)
+            lsh_rows.append((band, bucket, event_id))
+        updates.append((canonical_id, event_id))
+        signature_rows.append((event_id, blob))
+
+    conn.executemany("DELETE FROM event_signatures WHERE event_id = ?", empty)
+    conn.executemany("INSERT OR REPLACE INTO event_signatures (event_id, minhash) VALUES (?, ?)", signature_rows)
+    conn.executemany("INSERT INTO event_lsh (band, bucket, event_id) VALUES (?, ?, ?)", lsh_rows)
+    conn.executemany(f"UPDATE {TABLE_NAME} SET canonical_id = ? WHERE id = ?", updates)
+
+# --- Потоковая запись ---
+def export_csv(db_path=None, path=OUTPUT_CSV):
+    """
+    Выгрузка всех событий опубликованной базы в CSV. Пишется после publish(), поэтому файл
+    совпадает с тем, что видит бот, и не теряет события источников, не обойдённых в этом прогоне
+    """
+    conn = sqlite3.connect(f"file:{db_path or DB_NAME}?mode=ro", uri=True)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EVENT_COLUMNS)
+            writer.writerows(conn.execute(f"SELECT {', '.join(EVENT_COLUMNS)} FROM {TABLE_NAME} ORDER BY id"))
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+class DbWriter:
+    """Копит события и сохраняет их в staging-базу снимка пачками по WRITE_BATCH_SIZE в фоновом потоке"""
+
+    def __init__(self, metrics, snapshot, batch_size=WRITE_BATCH_SIZE):
+        self.metrics = metrics
+        self.snapshot = snapshot
+        self.batch_size = batch_size
+        self.batch = []
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        self.failed = False
+        # init_db нужен staging-базе один раз, а не на каждую пачку
+        self.initialized = False
+
+    async def write(self, events):
+        self.batch.extend(events)
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        started = time.perf_counter()
+        # Первая пачка ждёт другие прогоны и копирует опубликованную базу — тоже вне цикла событий
+        path = await asyncio.to_thread(self.snapshot.open)
+        counts = await asyncio.to_thread(save_events_to_db, batch, path, not self.initialized)
+        self.metrics.add_stage("db_write_ms", (time.perf_counter() - started) * 1000)
+        if counts is None:
+            # Прогон с потерянной пачкой не публикуется (main)
+            self.failed = True
+            return
+        self.initialized = True
+        for key in self.counts:
+            self.counts[key] += counts[key]
+
+    async def cluster(self):
+        """Склейка почти дубликатов записанных событий одним проходом перед публикацией"""
+        if self.failed or not (self.counts["inserted"] or self.counts["updated"]):
+            return
+        started = time.perf_counter()
+        if not await asyncio.to_thread(cluster_events, self.snapshot.open()):
+            self.failed = True
+        self.metrics.add_stage("dedup_ms", (time.perf_counter() - started) * 1000)
+
+async def run_pipeline(sources, force, pool, frontier, metrics, snapshot, enrich=False):
+    """Обход → разбор → классификация → запись в staging-базу, страница за страницей"""
+    stats = {"pages": 0, "failed": 0, "changed": 0, "found": 0, "relevant": 0}
+    # При повторе ссылки в одном прогоне остаётся первое событие
+    seen_links = set()
+    db_writer = DbWriter(metrics, snapshot)
+    global_sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiters = {}
+    enricher = DetailEnricher(frontier.known_links, global_sem, limiters, pool, fetch=enrich)
+    async for url, ok, changed, events, record in crawl(sources, force, pool, frontier, metrics, global_sem, limiters):
+        stats["pages"] += 1
+        if not ok:
+            stats["failed"] += 1
+            continue
+        if not changed:
+            print(f"[*] Без изменений: {url}")
+            continue
+        stats["changed"] += 1
+        stats["found"] += len(events)
+
+        started = time.perf_counter()
+        relevant = []
+        for e in enrich_and_filter(events):
+            if e["link"] not in seen_links:
+                seen_links.add(e["link"])
+                relevant.append(e)
+        metrics.add_stage("classify_ms", (time.perf_counter() - started) * 1000)
+        record["relevant"] = len(relevant)
+        stats["relevant"] += len(relevant)
+        started = time.perf_counter()
+        await enricher.enrich(relevant)
+        metrics.add_stage("enrich_ms", (time.perf_counter() - started) * 1000)
+        await db_writer.write(relevant)
+        for e in relevant:
+            print(f"{e['date']} | {e['detected_type']} | {e['title']} | {e['link']}")
+    await db_writer.flush()
+    await db_writer.cluster()
+    return stats, db_writer.counts, db_writer.failed
 
 # --- Загрузка источников ---
 def load_sources(file_path="sources.json"):
@@ -229,42 +1243,91 @@ def load_sources(file_path="sources.json"):
         return []
 
 # --- Main ---
-def main():
-    all_events = []
+def main(force=False, workers=PARSE_WORKERS, source=None, max_pages=MAX_PAGES, backfill=False,
+         metrics_prom=METRICS_PROM, enrich=ENRICH_DETAILS):
     sources = load_sources("sources.json")
+    if source:
+        sources = [src for src in sources if src["name"] == source]
     if not sources:
         print("[ERROR] Нет источников для парсинга")
         return
 
-    for src in sources:
-        print(f"[*] Парсим университет: {src['name']}")
+    metrics = CrawlMetrics(sources)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    snapshot = SnapshotWriter(DB_NAME)
+    try:
+        upgrade_db(snapshot)
+        # --backfill: проходим ленту вглубь, не останавливаясь на уже известных ссылках
+        frontier = Frontier(load_known_links(), BACKFILL_MAX_PAGES if backfill else max_pages, not backfill)
+        stats, counts, failed = asyncio.run(run_pipeline(sources, force, pool, frontier, metrics, snapshot, enrich))
+        # Бот видит результат прогона целиком или не видит вовсе; прерванный прогон не публикуется
+        if failed:
+            print("[ERROR] Часть событий не записана: прогон не опубликован, страницы будут разобраны заново")
+            counts = dict.fromkeys(counts, 0)
+        else:
+            if counts["inserted"] or counts["updated"]:
+                snapshot.publish()
+                try:
+                    export_csv()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"[ERROR] Не удалось выгрузить CSV: {e}")
+            get_http_cache().commit_pending()
+    finally:
+        snapshot.close()
+        get_http_cache().discard_pending()
+        if pool:
+            pool.shutdown()
 
-        news_url = src.get("news_url")
-        if news_url:
-            html = fetch(news_url)
-            if html:
-                events = parse_news_list(html, base_url=news_url)
-                all_events.extend(events)
+    metrics.finish()
+    try:
+        metrics.write_json(METRICS_REPORT)
+        if metrics_prom:
+            metrics.write_prometheus(metrics_prom)
+    except OSError as e:
+        print(f"[ERROR] Не удалось сохранить метрики прогона: {e}")
 
-        for doc_url in src.get("doc_urls", []):
-            html = fetch(doc_url)
-            if html:
-                events = parse_docs(html, base_url=doc_url)
-                all_events.extend(events)
-
-    print(f"[*] Всего найдено событий: {len(all_events)}")
-    filtered = enrich_and_filter(all_events)
-    print(f"[*] Оставлено релевантных событий: {len(filtered)}")
-
-    if filtered:
-        df = pd.DataFrame(filtered)
-        df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8-sig")
-        init_db()
-        save_events_to_db(filtered)
-        print(f"[*] События сохранены в CSV и базу данных {DB_NAME}")
-        print(df[["title","date","link","detected_type"]].to_string(index=False))
+    print(f"[*] Всего найдено событий: {stats['found']}")
+    print(f"[*] Оставлено релевантных событий: {stats['relevant']}")
+    if stats["relevant"]:
+        print(f"[*] События сохранены в CSV и базу данных {DB_NAME}: "
+              f"новых {counts['inserted']}, обновлено {counts['updated']}, без изменений {counts['unchanged']}")
     else:
         print("[*] Нет релевантных событий по ключевым словам")
 
+    # Итог для планировщика бота (parser_utils.RESULT_RE)
+    print(f"[RESULT] pages={stats['pages']} failed={stats['failed']} changed={stats['changed']} "
+          f"inserted={counts['inserted']} updated={counts['updated']}")
+
+def compare_main():
+    sources = load_sources("sources.json")
+    pages = []
+    for src in sources:
+        if src.get("news_url"):
+            pages.append((parse_news_list, src["news_url"]))
+        pages.extend((parse_docs, doc_url) for doc_url in src.get("doc_urls", []))
+    compare_backends([(parse, url, html) for parse, url in pages if (html := fetch(url))])
+
 if __name__ == "__main__":
-    main()
+    arg_parser = argparse.ArgumentParser(description="Парсер мероприятий университетов")
+    arg_parser.add_argument("--force", action="store_true", help="игнорировать HTTP-кэш и заново разобрать все страницы")
+    arg_parser.add_argument("--backend", default=PARSER_BACKEND, help="HTML-бэкенд: html.parser (по умолчанию), lxml, auto")
+    arg_parser.add_argument("--workers", type=int, default=PARSE_WORKERS, help="число процессов для разбора страниц")
+    arg_parser.add_argument("--max-pages", type=int, default=MAX_PAGES, help="сколько страниц пагинации ленты проходить")
+    arg_parser.add_argument("--backfill", action="store_true", help="пройти ленты вглубь, не останавливаясь на известных ссылках")
+    arg_parser.add_argument("--source", help="обойти только источник с этим именем из sources.json")
+    arg_parser.add_argument("--enrich", action="store_true", default=ENRICH_DETAILS,
+                            help="загрузить страницы новых событий за датой и полным описанием")
+    arg_parser.add_argument("--metrics-prom", default=METRICS_PROM, help="файл для метрик в текстовом формате Prometheus")
+    arg_parser.add_argument("--compare-backends", action="store_true", help="сравнить скорость и результат бэкендов")
+    arg_parser.add_argument("--rollback", action="store_true", help="вернуть предыдущий опубликованный снимок базы")
+    args = arg_parser.parse_args()
+
+    set_backend(args.backend)
+    if args.rollback:
+        rollback(DB_NAME, init_db)
+    elif args.compare_backends:
+        compare_main()
+    else:
+        main(force=args.force, workers=args.workers, source=args.source,
+             max_pages=args.max_pages, backfill=args.backfill, metrics_prom=args.metrics_prom,
+             enrich=args.enrich)
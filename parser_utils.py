@@ -1,15 +1,175 @@
-import subprocess
+import asyncio
+import json
+import logging
+import re
 import sys
 
-def run_parser():
-    """Запускает парсер как отдельный процесс"""
-    try:
-        result = subprocess.run([sys.executable, "parser.py"], 
-                              capture_output=True, text=True, encoding='utf-8')
-        
-        if result.returncode == 0:
-            return True, result.stdout
-        else:
-            return False, result.stderr
-    except Exception as e:
-        return False, str(e)
+logger = logging.getLogger(__name__)
+
+PROGRESS_RE = re.compile(r"\[PROGRESS\] sources=(\d+)/(\d+) events=(\d+)")
+RESULT_RE = re.compile(r"\[RESULT\] pages=(\d+) failed=(\d+) changed=(\d+) inserted=(\d+) updated=(\d+)")
+DONE_RE = re.compile(r"\[DONE\] ok=(\d)")
+
+# После стольких запусков процесс парсера перезапускается, чтобы не копить память
+WORKER_MAX_RUNS = 50
+
+class ParserJob:
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.progress = {"sources_done": 0, "sources_total": 0, "events_found": 0}
+
+class ParserWorker:
+    """
+    Один долгоживущий процесс parser_worker.py: импорты, HTTP-сессия и классификатор
+    не пересоздаются на каждое обновление. Запросы идут JSON-строками через stdin,
+    вывод парсера читается из stdout до строки [DONE]. Упавший процесс поднимается заново
+    """
+
+    def __init__(self):
+        self.proc = None
+        self.runs = 0
+
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        if self.alive() and self.runs < WORKER_MAX_RUNS:
+            return
+        await self.stop()
+        # stderr наследуется от бота: так он не переполнит неразобранный канал
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", "parser_worker.py",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+        self.runs = 0
+
+    async def stop(self):
+        if not self.alive():
+            self.proc = None
+            return
+        self.proc.stdin.close()
+        try:
+            await asyncio.wait_for(self.proc.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            self.proc.kill()
+            await self.proc.wait()
+        self.proc = None
+
+    async def run(self, request, on_line):
+        """Отправляет запрос и передаёт строки вывода в on_line; возвращает True, если запуск успешен"""
+        await self.start()
+        self.runs += 1
+        self.proc.stdin.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+        async for raw in self.proc.stdout:
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            m = DONE_RE.match(line)
+            if m:
+                return m.group(1) == "1"
+            await on_line(line)
+        # stdout закрылся без [DONE]: процесс упал, следующий запуск поднимет новый
+        await self.proc.wait()
+        await on_line(f"[ERROR] Процесс парсера завершился с кодом {self.proc.returncode}")
+        return False
+
+class RefreshManager:
+    """
+    Запускает парсер в фоне, не блокируя цикл событий бота.
+    Пока обновление идёт, повторные запросы присоединяются к нему, а не стартуют второй парсер.
+    Запуски по разным источникам выполняются по очереди, чтобы не писать в базу одновременно
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._write_lock = asyncio.Lock()
+        self.worker = ParserWorker()
+        # Итог последнего запуска по ключу (None — полное обновление, иначе имя источника)
+        self.last_results = {}
+        # async-колбэки (source, result) после каждого запуска, например рассылка подписчикам
+        self.finished_callbacks = []
+
+    def running(self, source=None):
+        job = self._jobs.get(source)
+        return job is not None and not job.task.done()
+
+    async def run(self, on_progress=None, source=None):
+        """Ждёт текущее (или новое) обновление; on_progress получает словарь прогресса"""
+        if not self.running(source):
+            job = ParserJob()
+            job.task = asyncio.create_task(self._run_parser(job, source))
+            self._jobs[source] = job
+        job = self._jobs[source]
+        if on_progress:
+            job.listeners.append(on_progress)
+        try:
+            # shield: отмена одного ожидающего обработчика не должна прерывать общий запуск
+            return await asyncio.shield(job.task)
+        finally:
+            if on_progress in job.listeners:
+                job.listeners.remove(on_progress)
+
+    async def _run_parser(self, job, source):
+        output = []
+        result = None
+
+        async def on_line(line):
+            nonlocal result
+            m = PROGRESS_RE.search(line)
+            if m:
+                job.progress = {
+                    "sources_done": int(m.group(1)),
+                    "sources_total": int(m.group(2)),
+                    "events_found": int(m.group(3))
+                }
+                await self._notify(job)
+                return
+            m = RESULT_RE.search(line)
+            if m:
+                result = dict(zip(("pages", "failed", "changed", "inserted", "updated"), map(int, m.groups())))
+                return
+            output.append(line)
+
+        # Процесс парсера один, поэтому запуски и так идут по очереди; lock держит их порядок
+        async with self._write_lock:
+            try:
+                success = await self.worker.run({"source": source}, on_line)
+            except Exception as e:
+                logger.exception("Процесс парсера недоступен")
+                await self.worker.stop()
+                self.last_results[source] = None
+                return False, str(e)
+
+        self.last_results[source] = result
+        for callback in self.finished_callbacks:
+            try:
+                await callback(source, result)
+            except Exception:
+                logger.exception("Ошибка в обработчике завершения обновления")
+        return success, "\n".join(output)
+
+    async def upgrade_db(self):
+        """Миграция схемы базы в процессе парсера до первых запросов бота; возвращает True при успехе"""
+        async def on_line(line):
+            logger.info("%s", line)
+
+        async with self._write_lock:
+            try:
+                return await self.worker.run({"upgrade": True}, on_line)
+            except Exception:
+                logger.exception("Процесс парсера недоступен")
+                await self.worker.stop()
+                return False
+
+    async def _notify(self, job):
+        for listener in list(job.listeners):
+            try:
+                await listener(dict(job.progress))
+            except Exception as e:
+                logger.warning("Не удалось показать прогресс обновления: %s", e)
+
+refresh_manager = RefreshManager()
+
+async def run_parser(on_progress=None, source=None):
+    """Запускает парсер как отдельный процесс, не блокируя бота"""
+    return await refresh_manager.run(on_progress, source)
@@ -0,0 +1,33 @@
+"""
+Долгоживущий процесс парсера для бота (см. parser_utils.ParserWorker).
+
+Читает из stdin по одной JSON-строке на запуск, например {"source": "ОГУ ...", "force": false},
+выполняет parser.main и печатает его обычный вывод, в конце — строку "[DONE] ok=1" или "[DONE] ok=0".
+Запрос {"upgrade": true} только приводит схему базы к текущей (parser.upgrade_db), без обхода.
+Импорты, HTTP-сессия с пулом keep-alive соединений и скомпилированный классификатор
+остаются в памяти между запусками
+"""
+import json
+import sys
+import traceback
+
+import parser
+
+def serve():
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        ok = True
+        try:
+            request = json.loads(line)
+            if request.get("upgrade"):
+                parser.upgrade_db()
+            else:
+                parser.main(force=request.get("force", False), source=request.get("source"))
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            ok = False
+        print(f"[DONE] ok={int(ok)}", flush=True)
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,93 @@
+import json
+import logging
+from parser_utils import run_parser, refresh_manager
+
+logger = logging.getLogger(__name__)
+
+SOURCES_FILE = "sources.json"
+
+# Интервалы в секундах; у источника свой базовый интервал через "interval_minutes" в sources.json
+DEFAULT_INTERVAL = 60 * 60
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 60 * 60
+STARTUP_STAGGER = 30
+
+class SourceSchedule:
+    """Состояние планирования одного источника между запусками"""
+
+    def __init__(self, name, base_interval):
+        self.name = name
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.failures = 0
+        self.unchanged = 0
+        # С прошлого обхода источника прошло полное обновление (/update) с новыми событиями: HTTP-кэш общий,
+        # поэтому изменения источника мог забрать тот прогон, а этот увидит страницы без изменений
+        self.full_run_since = False
+
+    def update(self, success, result):
+        """Пересчитывает интервал по итогу обхода и возвращает его"""
+        full_run_since, self.full_run_since = self.full_run_since, False
+        if not success or result is None or (result["pages"] and result["failed"] == result["pages"]):
+            # Источник недоступен: экспоненциальная задержка от базового интервала
+            self.failures += 1
+            self.interval = self.base_interval * 2 ** self.failures
+        elif result["inserted"] or result["updated"]:
+            # Источник часто обновляется: опрашиваем чаще
+            self.failures = 0
+            self.unchanged = 0
+            self.interval = self.interval / 2
+        elif full_run_since:
+            # Менялся ли источник, неизвестно: его страницы уже разобрало полное обновление.
+            # Интервал не растёт, иначе каждый /update удваивал бы его у часто меняющихся источников
+            self.failures = 0
+        else:
+            self.failures = 0
+            self.unchanged += 1
+            self.interval = self.base_interval * 2 ** self.unchanged
+        self.interval = max(MIN_INTERVAL, min(MAX_INTERVAL, self.interval))
+        return self.interval
+
+def load_schedules(file_path=SOURCES_FILE):
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            sources = json.load(f)
+    except Exception as e:
+        logger.error("Не удалось загрузить %s: %s", file_path, e)
+        return []
+    return [
+        SourceSchedule(src["name"], src.get("interval_minutes", DEFAULT_INTERVAL // 60) * 60)
+        for src in sources
+    ]
+
+async def crawl_source_job(context):
+    schedule = context.job.data
+    if refresh_manager.running():
+        # Идёт полное обновление по /update — этот источник в нём уже есть, интервал не меняем
+        await run_parser()
+        interval = schedule.interval
+    else:
+        success, _ = await run_parser(source=schedule.name)
+        interval = schedule.update(success, refresh_manager.last_results.get(schedule.name))
+    logger.info("Источник %s: следующий обход через %d мин", schedule.name, interval // 60)
+    context.job_queue.run_once(crawl_source_job, when=interval, data=schedule, name=f"crawl:{schedule.name}")
+
+def schedule_sources(app):
+    """Ставит в очередь приложения периодический обход каждого источника из sources.json"""
+    if app.job_queue is None:
+        logger.warning("JobQueue недоступна (pip install \"python-telegram-bot[job-queue]\"), автообновление выключено")
+        return
+    schedules = load_schedules()
+
+    async def on_refresh(source, result):
+        # Полное обновление без новых и изменённых событий ничего у источников не забрало
+        if source is None and result and (result["inserted"] or result["updated"]):
+            for schedule in schedules:
+                schedule.full_run_since = True
+
+    refresh_manager.finished_callbacks.append(on_refresh)
+    for i, schedule in enumerate(schedules):
+        # Разносим первые обходы, чтобы источники не стартовали одной пачкой
+        app.job_queue.run_once(
+            crawl_source_job, when=STARTUP_STAGGER * (i + 1), data=schedule, name=f"crawl:{schedule.name}"
+        )
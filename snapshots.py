@@ -0,0 +1,198 @@
+import glob
+import os
+import re
+import sqlite3
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: без блокировки, одновременные прогоны парсера не поддерживаются
+    fcntl = None
+
+# Сколько прошлых опубликованных снимков хранить для отката
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+
+GENERATION_RE = re.compile(r"\.gen(\d+)$")
+
+# --- Файлы снимков ---
+def is_wal_file(path):
+    """Режим журнала по заголовку файла: 2 — WAL (часть данных может лежать в -wal рядом)"""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(20)
+    except OSError:
+        return False
+    return len(header) == 20 and header[18] == 2
+
+def snapshot_id(path):
+    """Меняется, когда на место path опубликован другой файл"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def open_snapshot(path):
+    """
+    Соединение только для чтения. Опубликованный снимок больше не меняется, поэтому открывается
+    с immutable=1: SQLite не берёт блокировок и не читает -wal. Старую базу в режиме WAL
+    (до первой публикации) читаем обычным образом
+    """
+    uri = f"file:{path}?mode=ro" + ("" if is_wal_file(path) else "&immutable=1")
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+def copy_db(src, dst):
+    """Согласованная копия базы через backup API (учитывает и незавершённый -wal источника)"""
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True)
+    target = sqlite3.connect(dst)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def read_generation(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    return int(row[0]) if row else 0
+
+def list_snapshots(db_path):
+    """Сохранённые снимки [(поколение, путь)] от новых к старым"""
+    snapshots = []
+    for path in glob.glob(glob.escape(db_path) + ".gen*"):
+        m = GENERATION_RE.search(path)
+        if m:
+            snapshots.append((int(m.group(1)), path))
+    return sorted(snapshots, reverse=True)
+
+def remove_db_files(path):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+# --- Публикация ---
+class SnapshotWriter:
+    """
+    Staging-копия опубликованной базы. Парсер пишет в неё сколько угодно транзакций,
+    бот в это время читает опубликованный снимок. publish() подменяет файл атомарно
+    (os.replace), прошлый снимок остаётся рядом как db_path.gen<N> для отката.
+    Копия создаётся при первой записи: прогон без новых событий базу не трогает
+    """
+
+    def __init__(self, db_path, keep=SNAPSHOT_KEEP):
+        self.db_path = db_path
+        self.staging_path = db_path + ".staging"
+        self.keep = keep
+        self._lock_file = None
+
+    def open(self):
+        """Путь staging-базы; первый вызов ждёт другие прогоны и копирует опубликованную базу"""
+        if self._lock_file is None:
+            self._lock_file = open(self.db_path + ".lock", "w")
+            if fcntl:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            remove_db_files(self.staging_path)
+            if os.path.exists(self.db_path):
+                copy_db(self.db_path, self.staging_path)
+        return self.staging_path
+
+    def publish(self):
+        if self._lock_file is None:
+            return
+        conn = sqlite3.connect(self.staging_path)
+        try:
+            # Снимок — один самодостаточный файл: переносим -wal в базу и выключаем WAL
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            conn.close()
+
+        if os.path.exists(self.db_path):
+            backup_path = f"{self.db_path}.gen{read_generation(self.db_path)}"
+            remove_db_files(backup_path)
+            try:
+                if is_wal_file(self.db_path):
+                    raise OSError("база в режиме WAL")
+                # Опубликованный файл неизменяем: для отката достаточно жёсткой ссылки
+                os.link(self.db_path, backup_path)
+            except OSError:
+                copy_db(self.db_path, backup_path)
+        os.replace(self.staging_path, self.db_path)
+        # Хвосты старой базы в режиме WAL к новому файлу не относятся
+        for suffix in ("-wal", "-shm"):
+            try:
+                os.remove(self.db_path + suffix)
+            except OSError:
+                pass
+        for _, path in list_snapshots(self.db_path)[self.keep:]:
+            remove_db_files(path)
+        print(f"[*] Опубликован снимок базы {self.db_path} (поколение {read_generation(self.db_path)})")
+        self.close()
+
+    def close(self):
+        """Отбрасывает неопубликованную staging-базу и снимает блокировку"""
+        if self._lock_file is None:
+            return
+        remove_db_files(self.staging_path)
+        self._lock_file.close()
+        self._lock_file = None
+
+def rollback(db_path, init_db=None):
+    """
+    Возвращает последний сохранённый снимок. Отклонённая база остаётся как db_path.rejected.
+    Поколение и счётчик id продолжаются от отклонённой базы: кэш бота сбрасывается,
+    а id новых событий не повторяют уже разосланные. init_db(conn) (parser.init_db) приводит
+    восстановленную копию к текущей схеме: самый старый снимок может быть сделан до миграций
+    """
+    snapshots = list_snapshots(db_path)
+    if not snapshots:
+        print("[ERROR] Нет сохранённых снимков для отката")
+        return False
+    _, backup_path = snapshots[0]
+    writer = SnapshotWriter(db_path)
+    staging_path = writer.open()
+    try:
+        generation = read_generation(db_path)
+        rejected = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            sequences = rejected.execute("SELECT name, seq FROM sqlite_sequence").fetchall()
+        except sqlite3.OperationalError:
+            # В базе не было ни одной таблицы с AUTOINCREMENT
+            sequences = []
+        finally:
+            rejected.close()
+        remove_db_files(staging_path)
+        copy_db(backup_path, staging_path)
+        conn = sqlite3.connect(staging_path)
+        try:
+            with conn:
+                if init_db:
+                    init_db(conn)
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+                conn.execute("""
+                    INSERT INTO meta (key, value) VALUES ('generation', ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """, (generation + 1,))
+                for name, seq in sequences:
+                    if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?",
+                                        (seq, name)).rowcount:
+                        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (name, seq))
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            conn.close()
+
+        remove_db_files(db_path + ".rejected")
+        copy_db(db_path, db_path + ".rejected")
+        os.replace(staging_path, db_path)
+        remove_db_files(backup_path)
+        print(f"[*] База {db_path} откатена к снимку {backup_path}, отклонённая сохранена в {db_path}.rejected")
+        return True
+    finally:
+        writer.close()
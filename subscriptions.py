@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+import os
+
+# База событий у бота только для чтения, подписки хранятся отдельно
+SUBSCRIPTIONS_DB = os.getenv('SUBSCRIPTIONS_DB', 'subscriptions.db')
+
+KIND_TYPE = "type"
+KIND_KEYWORD = "keyword"
+
+class SubscriptionStore:
+    """Подписки чатов на тип события (detected_type) или ключевое слово и отметка последнего разосланного события"""
+
+    def __init__(self, path=SUBSCRIPTIONS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INTEGER,
+                kind TEXT,
+                value TEXT,
+                PRIMARY KEY (chat_id, kind, value)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_value ON subscriptions (kind, value)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS notify_state (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.commit()
+
+    def add(self, chat_id, kind, value):
+        """True, если подписки ещё не было"""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (chat_id, kind, value) VALUES (?, ?, ?)",
+                (chat_id, kind, value.lower())
+            )
+            self._conn.commit()
+        return cur.rowcount > 0
+
+    def remove(self, chat_id, value=None):
+        """Удаляет подписку на value (любого вида) или все подписки чата; возвращает число удалённых"""
+        with self._lock:
+            if value is None:
+                cur = self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+            else:
+                cur = self._conn.execute(
+                    "DELETE FROM subscriptions WHERE chat_id = ? AND value = ?", (chat_id, value.lower())
+                )
+            self._conn.commit()
+        return cur.rowcount
+
+    def list(self, chat_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT kind, value FROM subscriptions WHERE chat_id = ? ORDER BY kind, value", (chat_id,)
+            ).fetchall()
+
+    def subscribers(self, kind, value):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT chat_id FROM subscriptions WHERE kind = ? AND value = ?", (kind, value)
+            )]
+
+    def values(self, kind):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT value FROM subscriptions WHERE kind = ?", (kind,)
+            )]
+
+    def get_state(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM notify_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO notify_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+            self._conn.commit()